@@ -125,6 +125,13 @@ class Admin(commands.Cog):  # pylint: disable=missing-class-docstring
         days, hrs = divmod(hrs, 24)
         total_uptime = f"**{days}** days, **{hrs}** hours,\n**{mins}** minutes, **{secs}** seconds"
 
+        # Voice connections
+        voice_stats = self.bot.voice_sessions.stats()
+        voice_latency = "N/A"
+        if voice_stats["connects"]:
+            voice_latency = "{:.0f} ms (p95 {:.0f} ms)".format(voice_stats["connect_p50_ms"],
+                                                              voice_stats["connect_p95_ms"])
+
         # Stats embed message
         stats_embed = discord.Embed(title=None, description=None, colour=self.bot.embed_colour)
         stats_embed.set_author(name="About Me", icon_url=ctx.me.avatar_url)
@@ -154,7 +161,11 @@ class Admin(commands.Cog):  # pylint: disable=missing-class-docstring
                  ", ".join(thread_id for thread_id in bot_threads),
                  len(bot_threads), total_uptime), True),
             ("Sharding",
-             "Sharding not enabled", True)
+             "Sharding not enabled", True),
+            ("Voice",
+             "**Connected:** {}\n**Handshakes:** {}\n**Reused:** {}\n**Handshake Time**\n{}".format(
+                 voice_stats["connected"], voice_stats["connects"], voice_stats["reuses"],
+                 voice_latency), True)
         ]
         for name, value, inline in stats_fields:
             stats_embed.add_field(name=name, value=value, inline=inline)
@@ -3,60 +3,224 @@ to be a clown for past actions or things they said that is complete tomfoolery.
 The status is kept on them for a week, hence the name.
 """
 import asyncio
+import heapq
 import logging
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 
 import discord
 from discord.ext import commands, tasks
 
+from cogs.utils.clown_store import ClownCache, ClownStore, Poll, VOTE_NO, VOTE_YES
+from cogs.utils.soundfx import SoundEffects
+
+
+POLL_DELAY = 120 # This is in seconds
+HONK_DEBOUNCE = 1.0 # Seconds of quiet before reacting to the clown's voice activity
+
 
 class Clown(commands.Cog):
     """Stuff related to clown of the week"""
     def __init__(self, bot):
         self.bot = bot
-        self.polls = {}
-        self.query = None
-        self.result = None
+        self.polls = {}  # Message ID -> open Poll
+        self.poll_deadlines = []  # Heap of (deadline, message ID) for every open poll
+        self.poll_added = asyncio.Event()
+        self.store = None  # The database is attached after cogs are loaded
         self.server_clowns = None
+        self.sound_effects = SoundEffects()
+        self.pending_honks = {}  # Guild ID -> scheduled honk that is waiting for the burst to end
+        self.honking = set()  # Guild IDs that a honk is connecting or playing in
+        self.voice_events = {"seen": 0, "dropped": 0, "coalesced": 0, "acted": 0}
+        self.load_sounds.start() # pylint: disable=no-member
         self.update_cache.start() # pylint: disable=no-member
+        self.resolve_polls.start() # pylint: disable=no-member
         self.log = logging.getLogger(__name__)
 
     def cog_unload(self):
+        self.update_cache.cancel() # pylint: disable=no-member
+        self.resolve_polls.cancel() # pylint: disable=no-member
+        for handle in self.pending_honks.values():
+            handle.cancel()
+        self.pending_honks = {}
+        if self.server_clowns is not None:
+            self.bot.loop.create_task(self.server_clowns.close())
+        # Open polls stay in the database and are resumed when the cog is loaded again
         self.polls = {}
-        self.query = None
-        self.result = None
+        self.poll_deadlines = []
         self.server_clowns = None
         self.log.info("Cog unloaded; disconnecting from voice channels")
 
     @tasks.loop(count=1)
-    async def update_cache(self):
-        """Updates the memory cache on startup or entry update"""
-        async with self.bot.db.acquire() as conn:
-            results = await conn.fetch("SELECT * FROM clowns;")
-            self.server_clowns = {result["guild_id"]: result["clown_id"] for result in results}
-        self.log.info("Refreshed memory cache of server clowns")
+    async def load_sounds(self):
+        """Encodes the sound effects once so honking never has to start ffmpeg"""
+        await self.sound_effects.load()
 
-    @tasks.loop(count=1)
-    async def fetch_row(self):
-        """Sends a fetch_row query to the PostgreSQL server"""
-        # Make sure the input is sanitized before executing queries
-        async with self.bot.db.acquire() as conn:
-            self.result = await conn.fetchrow(self.query)
+    def honk_source(self) -> discord.AudioSource:
+        """Creates the honk from memory, or decodes it with ffmpeg if it is not loaded yet."""
+        source = self.sound_effects.source("honk")
+        if source is None:
+            source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio("soundfx/honk.mp3"))
+        return source
+
+    @tasks.loop(seconds=30)
+    async def update_cache(self):
+        """Fills the memory cache on startup and whenever changes from other processes
+        could have been missed because the listening connection was lost
+        """
+        if self.server_clowns.listening and self.server_clowns.loaded:
+            return
+        try:
+            if not self.server_clowns.listening:
+                await self.server_clowns.listen()
+            # Loading is retried on its own, so a failed load is not hidden by a working listener
+            await self.server_clowns.load()
+        except Exception as exc: # pylint: disable=broad-except
+            self.log.error("Unable to load server clowns; %s: %s", type(exc).__name__, exc)
+            return
+        self.log.info("Loaded memory cache of %d server clowns", len(self.server_clowns.clowns))
 
-    @fetch_row.before_loop
     @update_cache.before_loop
     async def delay_queries(self):
         """Prevents queries from executing until a database connection can be established"""
         await self.bot.wait_until_ready()
+        if self.store is None:
+            self.store = ClownStore(self.bot.db)
+            self.server_clowns = ClownCache(self.store)
+
+    @tasks.loop()
+    async def resolve_polls(self):
+        """Resolves every poll whose voting ended, then waits for the next deadline.
+        This is the only task that waits on polls, no matter how many are open.
+        """
+        self.poll_added.clear()
+        now = datetime.now(timezone.utc)
+        while self.poll_deadlines and self.poll_deadlines[0][0] <= now:
+            _, message_id = heapq.heappop(self.poll_deadlines)
+            poll = self.polls.pop(message_id, None)
+            if poll is None:
+                continue
+            try:
+                await self.finish_poll(poll)
+            except Exception as exc: # pylint: disable=broad-except
+                self.log.error("Unable to resolve poll %s; %s: %s",
+                               poll.message_id, type(exc).__name__, exc)
+
+        timeout = None
+        if self.poll_deadlines:
+            timeout = (self.poll_deadlines[0][0] - now).total_seconds()
+        try:
+            await asyncio.wait_for(self.poll_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @resolve_polls.before_loop
+    async def resume_polls(self):
+        """Picks up the polls that were still open when the bot was last stopped.
+        Votes cast while it was offline are counted from the poll messages once.
+        """
+        await self.delay_queries()
+        try:
+            open_polls = await self.store.open_polls()
+        except Exception as exc: # pylint: disable=broad-except
+            self.log.error("Unable to resume polls; %s: %s", type(exc).__name__, exc)
+            return
+
+        for poll in open_polls:
+            if self.bot.get_guild(poll.guild_id) is None:
+                continue # The server belongs to another shard
+            channel = self.bot.get_channel(poll.channel_id)
+            try:
+                message = await channel.fetch_message(poll.message_id)
+            except (AttributeError, discord.HTTPException):
+                await self.store.delete_poll(poll.message_id)
+                continue
+            for reaction in message.reactions:
+                if str(reaction.emoji) in poll.votes:
+                    poll.votes[str(reaction.emoji)] = reaction.count - (1 if reaction.me else 0)
+            poll.cleared = not set(poll.votes) <= {str(reaction.emoji)
+                                                   for reaction in message.reactions}
+            self.add_poll(poll)
+        self.log.info("Resumed %d open polls", len(self.polls))
+
+    def add_poll(self, poll: Poll):
+        """Starts counting votes for a poll and schedules when it is resolved."""
+        self.polls[poll.message_id] = poll
+        heapq.heappush(self.poll_deadlines, (poll.ends_at, poll.message_id))
+        self.poll_added.set()
+
+    async def finish_poll(self, poll: Poll):
+        """Announces the outcome of a poll and changes the clown if the nomination passed."""
+        await self.store.delete_poll(poll.message_id)
+        channel = self.bot.get_channel(poll.channel_id)
+        if channel is None:
+            return
+        error_icon = self.bot.icons["fail"]
+        if poll.cleared:
+            await channel.send(
+                f"{error_icon} Someone with moderator powers removed all the votes :eyes:")
+            return
+        if not poll.passed():
+            await channel.send(f"{error_icon} Nomination failed to gain enough votes.")
+            return
+
+        # Change the clown because enough votes were in favor of the nomination
+        await self.server_clowns.set(poll.guild_id, poll.nominee_id)
+
+        # Display who the new clown is
+        info_icon = self.bot.icons["info"]
+        nominee = channel.guild.get_member(poll.nominee_id)
+        if nominee is None:
+            try:
+                nominee = await channel.guild.fetch_member(poll.nominee_id)
+            except discord.HTTPException:
+                await channel.send(f"{info_icon} The clown is now <@{poll.nominee_id}>.")
+                return
+        if not nominee.nick:
+            await channel.send(f"{info_icon} The clown is now `{nominee}`.")
+        else:
+            await channel.send(f"{info_icon} The clown is now `{nominee}` (`{nominee.nick}`).")
+
+    def count_vote(self, payload: discord.RawReactionActionEvent, change: int):
+        """Adds or removes a vote for a poll, ignoring anything else that was reacted with."""
+        poll = self.polls.get(payload.message_id)
+        if poll is None or payload.user_id == self.bot.user.id:
+            return
+        emoji = str(payload.emoji)
+        if emoji in poll.votes:
+            poll.votes[emoji] += change
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        """Counts a vote on an open poll."""
+        self.count_vote(payload, 1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload):
+        """Takes back a vote on an open poll."""
+        self.count_vote(payload, -1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload):
+        """Voids an open poll when all of its reactions are removed."""
+        if payload.message_id in self.polls:
+            self.polls[payload.message_id].cleared = True
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload):
+        """Voids an open poll when every vote for one of its options is removed."""
+        poll = self.polls.get(payload.message_id)
+        if poll is not None and str(payload.emoji) in poll.votes:
+            poll.cleared = True
 
     @commands.group(name="clown")
     @commands.cooldown(rate=1, per=3.0, type=commands.BucketType.guild)
     async def clown(self, ctx):
         """Shows who the clown is in a server"""
         if ctx.invoked_subcommand is None:
-            if not self.server_clowns:
+            if self.server_clowns is None:
                 raise commands.BadArgument("Unable to retrieve data. Try again later.")
-            if ctx.guild.id not in self.server_clowns or not self.server_clowns[ctx.guild.id]:
+            clown_id = await self.server_clowns.get(ctx.guild.id)
+            if not clown_id:
                 info_icon = self.bot.icons["info"]
                 await ctx.send(f"{info_icon} The clown is no one.")
                 return
@@ -64,8 +228,8 @@ class Clown(commands.Cog):
             # MemberConverter requires a string value
             try:
                 server_clown = await commands.MemberConverter().convert(
-                    ctx, str(self.server_clowns[ctx.guild.id]))
-                self.log.debug(self.server_clowns[ctx.guild.id])
+                    ctx, str(clown_id))
+                self.log.debug(clown_id)
             except commands.BadArgument:
                 raise commands.BadArgument("The clown is no longer in the server.")
             else:
@@ -80,7 +244,7 @@ class Clown(commands.Cog):
     async def nominate_clown(self, ctx: commands.Context, mention: str, *, reason: str):
         """Nominate someone to be clown of the week! :clown:"""
         # Parse arguments
-        if ctx.message.guild.id in self.polls and self.polls[ctx.message.guild.id]:
+        if any(poll.guild_id == ctx.message.guild.id for poll in self.polls.values()):
             raise commands.BadArgument("A nomination is currently in progress.")
         if len(reason) > 1900:
             raise commands.BadArgument("1900 characters or less, por favor.")
@@ -92,70 +256,35 @@ class Clown(commands.Cog):
             raise commands.BadArgument("This command is unavailable for bots.")
 
         # Pull latest data from database
-        self.query = f"SELECT clown_id, clowned_on FROM clowns WHERE guild_id = {ctx.message.guild.id};" # pylint: disable=line-too-long
-        self.fetch_row.start() # pylint: disable=no-member
-        while self.fetch_row.is_running(): # pylint: disable=no-member
-            await asyncio.sleep(1)
+        if self.store is None:
+            raise commands.BadArgument("Unable to retrieve data. Try again later.")
+        current_clown = await self.store.get_clown(ctx.message.guild.id)
 
         # Prevent the clown from un-clowning themselves until a week passed
-        if (self.result and
-                (self.result["clowned_on"] + timedelta(days=7)) >= date.today() and
-                self.result["clown_id"] == ctx.message.author.id):
+        if (current_clown and
+                (current_clown["clowned_on"] + timedelta(days=7)) >= date.today() and
+                current_clown["clown_id"] == ctx.message.author.id):
             raise commands.BadArgument("Clowns are not allowed to do that.")
 
         # Create the clown of the week nomination message
-        poll_delay = 120 # This is in seconds
+        ends_at = datetime.now(timezone.utc) + timedelta(seconds=POLL_DELAY)
         poll_embed = discord.Embed(title="Clown of the Week",
                                    description=f"{mention} was nominated because:\n\n{reason}",
                                    colour=self.bot.embed_colour,
-                                   timestamp=(datetime.utcnow() + timedelta(seconds=poll_delay)))
+                                   timestamp=ends_at)
         poll_embed.set_author(name=f"Nominated by: {ctx.message.author}",
                               icon_url=ctx.author.avatar_url)
         poll_embed.set_footer(text="Voting will end")
 
-        # Set a poll semaphore for the server and then send the nomination message
-        self.polls[ctx.message.guild.id] = await ctx.send(embed=poll_embed)
-        await self.polls[ctx.message.guild.id].add_reaction("\N{white heavy check mark}")
-        await self.polls[ctx.message.guild.id].add_reaction("\N{cross mark}")
-
-        await asyncio.sleep(poll_delay)
-        # def vote_check(reaction, user):
-        #     return user == ctx.message.author and str(reaction.emoji) in ["✅", "❌"]
-
-        # Refresh message for reaction changes
-        self.polls[ctx.message.guild.id] = await ctx.message.channel.fetch_message(
-            self.polls[ctx.message.guild.id].id)
-        # Check the results of the poll
-        results = {reaction.emoji: reaction.count
-                   for reaction in self.polls[ctx.message.guild.id].reactions}
-        if "❌" not in results or "✅" not in results:
-            # Undo semaphore
-            self.polls[ctx.message.guild.id] = None
-            raise commands.BadArgument("Someone with moderator powers removed all the votes :eyes:")
-        if results["❌"] >= results["✅"]:
-            # Undo semaphore
-            self.polls[ctx.message.guild.id] = None
-            raise commands.BadArgument("Nomination failed to gain enough votes.")
-
-        # Change the clown because enough votes were in favor of the nomination
-        if self.result:
-            self.query = f"UPDATE clowns SET clown_id = {mention.id}, clowned_on = NOW() WHERE guild_id = {ctx.message.guild.id};" # pylint: disable=line-too-long
-        else:
-            self.query = f"INSERT INTO clowns (guild_id, clown_id, clowned_on) VALUES('{ctx.message.guild.id}', '{mention.id}', NOW());" # pylint: disable=line-too-long
-        self.fetch_row.start() # pylint: disable=no-member
-        while self.fetch_row.is_running(): # pylint: disable=no-member
-            await asyncio.sleep(1)
-        self.update_cache.start() # pylint: disable=no-member
-
-        # Display who the new clown is
-        if not mention.nick:
-            await ctx.send(f"{self.bot.icons['info']} The clown is now `{mention}`.")
-        else:
-            await ctx.send(
-                f"{self.bot.icons['info']} The clown is now `{mention}` (`{mention.nick}`).")
-
-        # Undo semaphore
-        self.polls[ctx.message.guild.id] = None
+        # The poll is saved before voting opens, which also ensures one poll per server
+        message = await ctx.send(embed=poll_embed)
+        poll = Poll(message.id, ctx.message.guild.id, ctx.message.channel.id, mention.id, ends_at)
+        if not await self.store.create_poll(poll):
+            await message.delete()
+            raise commands.BadArgument("A nomination is currently in progress.")
+        self.add_poll(poll)
+        await message.add_reaction(VOTE_YES)
+        await message.add_reaction(VOTE_NO)
 
     @nominate_clown.error
     async def nominate_clown_error(self, ctx, error):
@@ -172,19 +301,7 @@ class Clown(commands.Cog):
     @commands.bot_has_guild_permissions(connect=True, speak=True)
     async def honk(self, ctx):
         """Honk at the clown when they're in the same voice channel as you"""
-        def cleanup(error):
-            if error:
-                self.log.error("voice_client: %s", error)
-            disconnect = ctx.voice_client.disconnect()
-            run = asyncio.run_coroutine_threadsafe(disconnect, self.bot.loop)
-            try:
-                run.result()
-            except Exception as exc: # pylint: disable=broad-except
-                self.log.error("%s: %s", type(exc).__name__, exc)
-
-        file_name = "soundfx/honk.mp3"
-        source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(file_name))
-        ctx.voice_client.play(source, after=cleanup)
+        self.bot.voice_sessions.play(ctx.voice_client, self.honk_source())
 
     @honk.before_invoke
     async def prepare_clown(self, ctx):
@@ -195,21 +312,33 @@ class Clown(commands.Cog):
             current TEXT channel, but not the actual voice channel.
         """
         # If initial set command was not run or clown in server is set to no one
-        if ctx.guild.id not in self.server_clowns or self.server_clowns[ctx.guild.id] is None:
+        if self.server_clowns is None:
+            raise commands.BadArgument("Unable to retrieve data. Try again later.")
+        clown_id = await self.server_clowns.get(ctx.guild.id)
+        if clown_id is None:
             raise commands.BadArgument("No clown was set.")
 
         # Check the clown is in the voice channel
         if not ctx.author.voice:
             raise commands.BadArgument("You are not connected to a voice channel.")
-        clowns_found = [member for member in ctx.author.voice.channel.members if member.id == self.server_clowns[ctx.guild.id]]
+        clowns_found = [member for member in ctx.author.voice.channel.members if member.id == clown_id]
         if len(clowns_found) == 0:
             raise commands.BadArgument("Clown is not in the voice channel.")
 
-        # Check if bot is already connected to a voice channel
-        if not ctx.voice_client:
-            await self.connect_voice(ctx.author.voice.channel, ctx=ctx)
-        elif ctx.voice_client.is_playing():
+        # Reuse the connection if the bot is still connected from earlier
+        if ctx.voice_client and ctx.voice_client.is_playing():
             raise commands.BadArgument("There is audio already playing in a channel.")
+        if self.music_active(ctx.guild.id):
+            raise commands.BadArgument("Music is being played in this server.")
+        await self.connect_voice(ctx.author.voice.channel, ctx=ctx)
+
+    def music_active(self, guild_id: int) -> bool:
+        """Whether the Music cog is playing a queue in a server.
+        Between tracks nothing is playing, but honking would still drag the music away.
+        """
+        music = self.bot.get_cog("Music")
+        player = music.players.get(guild_id) if music is not None else None
+        return player is not None and player.active
 
     async def connect_voice(self, voice: discord.VoiceChannel, ctx: commands.Context = None):
         """Custom voice channel permission checker that was implemented because...
@@ -217,52 +346,79 @@ class Clown(commands.Cog):
             this permission in one of the roles it has in the SERVER, and the
         2. @commands.bot_has_permissions(...) decorator checks the permissions in the
             current TEXT channel, but not the actual voice channel.
+        Returns the voice client, or None if permissions are missing and no ctx was given.
         """
         self_permissions = voice.permissions_for(voice.guild.me)
         if self_permissions.connect and self_permissions.speak:
-            await voice.connect()
-            return
+            return await self.bot.voice_sessions.connect(voice)
         if ctx:
             required_perms = {"connect": self_permissions.connect, "speak": self_permissions.speak}
             missing_perms = "`, `".join(perm for perm, val in required_perms.items() if not val)
-            icon = self.bot.icons["fail"]
-            ctx.send(f"{icon} I'm missing `{missing_perms}` permission(s) for the voice channel.")
+            raise commands.BadArgument(
+                f"I'm missing `{missing_perms}` permission(s) for the voice channel.")
+        return None
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
         """Triggers when the clown joins a voice channel and was not previously in another voice
-        channel in the server. It will also ignore rapid connects and disconnects from the clown.
+        channel in the server. Bursts of connects, disconnects and channel hops from the clown
+        are collapsed into one honk that is decided once the clown settles down.
         """
-        await self.bot.wait_until_ready()
-        if not before.channel and after.channel:
-            current_server_id = after.channel.guild.id
-            if (current_server_id in self.server_clowns and
-                    member.id == self.server_clowns[current_server_id]):
-                await asyncio.sleep(1) # Buggy sound without delay
-                after_cache = after.channel
-                if after_cache and not after_cache.guild.voice_client:
-                    await self.connect_voice(after_cache)
-
-                    if (after_cache.guild.voice_client and
-                            not after_cache.guild.voice_client.is_playing()):
-                        sound_file = "soundfx/honk.mp3"
-                        sound_source = discord.PCMVolumeTransformer(
-                            discord.FFmpegPCMAudio(
-                                executable="/usr/bin/ffmpeg",
-                                source=sound_file))
-
-                        def cleanup(error):
-                            if error:
-                                self.log.error("voice_client: %s", error)
-                            disconnect = after_cache.guild.voice_client.disconnect()
-                            run = asyncio.run_coroutine_threadsafe(disconnect, self.bot.loop)
-                            try:
-                                run.result()
-                            except Exception as exc: # pylint: disable=broad-except
-                                self.log.error("%s: %s", type(exc).__name__, exc)
-
-                        after_cache.guild.voice_client.play(
-                            sound_source, after=cleanup)
+        # This fires for everyone, so anyone who is not the clown is rejected before any await
+        self.voice_events["seen"] += 1
+        guild_id = member.guild.id
+        if self.server_clowns is None or not self.server_clowns.is_clown(guild_id, member.id):
+            self.voice_events["dropped"] += 1
+            return
+        pending = self.pending_honks.pop(guild_id, None)
+        if pending is not None:
+            pending.cancel()
+            self.voice_events["coalesced"] += 1
+        elif before.channel or not after.channel:
+            self.voice_events["dropped"] += 1
+            return
+        self.pending_honks[guild_id] = self.bot.loop.call_later(
+            HONK_DEBOUNCE, lambda: self.bot.loop.create_task(self.honk_clown(member)))
+
+    async def honk_clown(self, member: discord.Member):
+        """Honks in the voice channel the clown ended up in, if they are still connected."""
+        guild = member.guild
+        self.pending_honks.pop(guild.id, None)
+        channel = member.voice.channel if member.voice else None
+        voice_client = guild.voice_client
+        if (channel is None or guild.id in self.honking or
+                (voice_client is not None and voice_client.is_playing()) or
+                self.music_active(guild.id)):
+            self.voice_events["dropped"] += 1
+            return
+
+        self.honking.add(guild.id)
+        try:
+            voice_client = await self.connect_voice(channel)
+            if voice_client is not None and not voice_client.is_playing():
+                self.bot.voice_sessions.play(voice_client, self.honk_source())
+                self.voice_events["acted"] += 1
+        except Exception as exc: # pylint: disable=broad-except
+            # Honks run as their own tasks, so nothing else would report the error
+            self.log.error("Unable to honk at the clown of %s; %s: %s",
+                           guild.id, type(exc).__name__, exc)
+        finally:
+            self.honking.discard(guild.id)
+
+    @clown.command(name="stats", hidden=True)
+    @commands.is_owner()
+    async def clown_stats(self, ctx):
+        """Shows how the clown cache and the auto-honk listener are doing"""
+        cache = self.server_clowns
+        await ctx.send("{} **Cache:** {} servers, {} hits, {} misses\n"
+                       "**Voice events:** {} seen, {} dropped, {} coalesced, {} honked".format(
+                           self.bot.icons["info"],
+                           len(cache.clowns) if cache else 0,
+                           cache.hits if cache else 0,
+                           cache.misses if cache else 0,
+                           self.voice_events["seen"], self.voice_events["dropped"],
+                           self.voice_events["coalesced"], self.voice_events["acted"]))
+
 
 def setup(bot):
     """Adds this module in as a cog to Pingu."""
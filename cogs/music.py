@@ -1,16 +1,21 @@
 """This module houses music/video streaming"""
-import asyncio
+import logging
+import math
 
 import discord
 import youtube_dl
 from discord.ext import commands
 
+import settings
+from cogs.utils.audio_cache import AudioCache, query_key, track_key
+from cogs.utils.extraction import ExtractionCache
+from cogs.utils.music_queue import GuildQueue, Track, stream_expiry
+from cogs.utils.streaming import StreamUsage, open_stream
 
-# This class has been retrieved from the basic voice bot example on the discord.py GitHub page.
-# Modified from original code by adding a queue functionality.
+
+# These options have been retrieved from the basic voice bot example on the discord.py GitHub page.
 ytdl_format_options = {
     "format": "bestaudio/best",
-    "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
     "restrictfilenames": True,
     "noplaylist": True,
     "nocheckcertificate": True,
@@ -22,42 +27,175 @@ ytdl_format_options = {
     "source_address": "0.0.0.0"  # Bind to ipv4 since ipv6 addresses cause issues sometimes
 }
 ffmpeg_options = {
+    # Streams can drop in the middle of a track, so ffmpeg has to reconnect on its own
+    "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
     "options": "-vn"
 }
 ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
 
 
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
-        self.data = data
-        self.title = data.get("title")
-        self.url = data.get("url")
+def download_track(data: dict, path: str) -> None:
+    """Downloads the format that was extracted for a track to a path."""
+    options = dict(ytdl_format_options, outtmpl=path.replace("%", "%%"))
+    with youtube_dl.YoutubeDL(options) as downloader:
+        downloader.process_info(dict(data))
+
+
+class Player:
+    """Plays the queue of a server one track after another.
+    A single task waits for each track's playback to complete, so nothing polls the voice client.
+    """
+    def __init__(self, bot, guild: discord.Guild, queue: GuildQueue, open_source):
+        """
+        :param open_source: Coroutine function that opens the audio source of a resolved track
+        """
+        self.bot = bot
+        self.guild = guild
+        self.queue = queue
+        self.open_source = open_source
+        self.task = None
+        self.log = logging.getLogger(__name__)
+
+    @property
+    def active(self) -> bool:
+        """Whether the player is playing or getting the next track ready."""
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> None:
+        """Starts playing the queue unless it is already being played."""
+        if not self.active:
+            self.task = self.bot.loop.create_task(self.run())
+
+    def stop(self) -> None:
+        """Stops playing the queue and empties it."""
+        self.queue.clear()
+        if self.active:
+            self.task.cancel()
 
-    @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+    async def run(self) -> None:
+        """Plays tracks until the queue is empty or the bot leaves the voice channel.
+        A track that fails to play is skipped, so one bad track never stops the queue.
+        """
+        try:
+            while self.guild.voice_client is not None:
+                track = self.queue.next()
+                if track is None:
+                    break
+                source = None
+                try:
+                    await self.queue.ready(track)
+                    source = await self.open_source(track)
+                    if self.guild.voice_client is None:
+                        source.cleanup()
+                        break
+                    playback = self.bot.voice_sessions.play(self.guild.voice_client, source,
+                                                            keep_connection=True)
+                except (youtube_dl.DownloadError, youtube_dl.utils.UnsupportedError):
+                    await self.announce(f":x: Something went wrong or `{track.query}` "
+                                        "is unsupported. Skipping it.")
+                    continue
+                except Exception as exc: # pylint: disable=broad-except
+                    self.log.error("Unable to play %s; %s: %s",
+                                   track.query, type(exc).__name__, exc)
+                    if source is not None:
+                        source.cleanup()
+                    await self.announce(f":x: Something went wrong playing `{track.query}`. "
+                                        "Skipping it.")
+                    continue
 
-        if "entries" in data:
-            # Take first item from a playlist
-            data = data["entries"][0]
+                await self.announce(f":musical_note: Now playing: {track.title}")
+                # Completes when the track ends, is skipped or the bot is disconnected
+                await playback.done
+        finally:
+            self.queue.current = None
+            self.bot.voice_sessions.release(self.guild.id)
 
-        filename = data["url"] if stream else ytdl.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+    async def announce(self, message: str) -> None:
+        """Sends a message to the channel the queue was started from."""
+        try:
+            await self.queue.channel.send(message)
+        except discord.HTTPException as exc:
+            self.log.error("Unable to announce in %s; %s: %s",
+                           self.queue.channel, type(exc).__name__, exc)
 
 
 class Music(commands.Cog):
     """This is not ready to be used."""
     def __init__(self, bot):
         self.bot = bot
+        self.players = {}  # Guild ID -> Player
+        self.stream_usage = StreamUsage()
+        self.extractions = ExtractionCache(lambda query: ytdl.extract_info(query, download=False),
+                                           max_workers=settings.MUSIC_EXTRACT_WORKERS,
+                                           maxsize=settings.MUSIC_EXTRACT_CACHE_SIZE)
+        self.audio_cache = AudioCache(settings.MUSIC_CACHE_DIRECTORY, settings.MUSIC_CACHE_BYTES,
+                                      download_track)
+        self.audio_cache.load()
+        self.log = logging.getLogger(__name__)
+
+    def cog_unload(self):
+        for player in self.players.values():
+            player.stop()
+        self.players = {}
+        self.extractions.shutdown()
+        self.audio_cache.shutdown()
+
+    async def resolve_track(self, track: Track):
+        """Looks up where to stream a track from, unless it was downloaded already."""
+        # Once a search was resolved, resolving it again must find the same video
+        query = track.webpage_url or track.query
+        key = track.cache_key or query_key(query)
+        entry = self.audio_cache.lookup(key)
+        if entry is not None:
+            # Downloaded tracks are played from disk, so the extractor is not needed at all
+            data = entry
+            track.stream_url = self.audio_cache.audio_path(entry)
+            track.expires_at = math.inf
+        else:
+            data = await self.extractions.get(query)
+            track.stream_url = data["url"]
+            track.expires_at = stream_expiry(track.stream_url)
+            if data.get("extractor_key") and data.get("id"):
+                key = track_key(data["extractor_key"], data["id"])
+                self.audio_cache.fetch(key, data)
+        track.cache_key = key
+        track.title = data.get("title")
+        track.webpage_url = data.get("webpage_url")
+        acodec = data.get("acodec")
+        track.codec = acodec if acodec and acodec != "none" else None
+
+    async def open_source(self, track: Track) -> discord.AudioSource:
+        """Opens the audio of a resolved track, copying it through if it is Opus already."""
+        path = self.audio_cache.get(track.cache_key)
+        if path is not None:
+            return await open_stream(path, self.stream_usage, codec=track.codec,
+                                     volume=settings.MUSIC_VOLUME,
+                                     options=ffmpeg_options["options"])
+        if track.expires_at == math.inf:
+            # Its download was evicted after it was resolved, so it is streamed after all
+            await self.resolve_track(track)
+        return await open_stream(track.stream_url, self.stream_usage, codec=track.codec,
+                                 volume=settings.MUSIC_VOLUME, **ffmpeg_options)
+
+    def get_player(self, ctx) -> Player:
+        """Retrieves the player of a server, creating one if it does not have one yet."""
+        player = self.players.get(ctx.guild.id)
+        if player is None:
+            player = self.players[ctx.guild.id] = Player(self.bot, ctx.guild,
+                                                         GuildQueue(self.resolve_track),
+                                                         self.open_source)
+        player.queue.channel = ctx.channel
+        return player
 
     @commands.command(name="stop")
     @commands.cooldown(1, 5, commands.BucketType.guild)
     async def stop_music(self, ctx):
         """Stop playing music and disconnect from the voice channel."""
+        player = self.players.pop(ctx.guild.id, None)
+        if player is not None:
+            player.stop()
         if ctx.voice_client is not None:
-            await ctx.voice_client.disconnect()
+            await self.bot.voice_sessions.disconnect(ctx.guild.id, force=True)
             await ctx.send(":information_source: Leaving voice channel.")
         else:
             await ctx.send(":information_source: Nothing is playing right now.")
@@ -66,23 +204,105 @@ class Music(commands.Cog):
     @commands.cooldown(1, 5, commands.BucketType.guild)
     async def clear_music(self, ctx):
         """Clear the current music queue."""
-        await ctx.send("No queue system exists yet.")
+        queue = self.players[ctx.guild.id].queue if ctx.guild.id in self.players else None
+        if queue is None or not queue.upcoming:
+            await ctx.send(":information_source: The queue is already empty.")
+            return
+        queue.clear()
+        await ctx.send(":information_source: Cleared the queue.")
 
     @commands.command(name="play")
     @commands.cooldown(1, 5, commands.BucketType.guild)
-    async def play_music(self, ctx, url):
-        """Play something from a given valid URL."""
-        if ctx.voice_client.is_playing():
-            await ctx.send("No queue system implemented yet. Can only play one song at a time.")
+    async def play_music(self, ctx, *, url):
+        """Play something from a given valid URL or search, or add it to the queue."""
+        player = self.get_player(ctx)
+        if not player.active and ctx.voice_client.is_playing():
+            raise commands.BadArgument("There is audio already playing in a channel.")
+        position = player.queue.add(Track(url, ctx.author))
+        if not player.active:
+            player.start()
+        else:
+            await ctx.send(f":information_source: Added `{url}` to the queue (#{position}).")
 
-        async with ctx.typing():
-            try:
-                player = await YTDLSource.from_url(url, loop=self.bot.loop)
-                ctx.voice_client.play(player, after=lambda e: print(f"Player error: {e}") if e else None)
-            except (youtube_dl.DownloadError, youtube_dl.utils.UnsupportedError):
-                raise commands.CommandError("Something went wrong or this URL is unsupported.")
+    @commands.command(name="skip")
+    @commands.cooldown(1, 2, commands.BucketType.guild)
+    async def skip_music(self, ctx):
+        """Skip the track that is playing."""
+        if ctx.voice_client is None or not ctx.voice_client.is_playing():
+            await ctx.send(":information_source: Nothing is playing right now.")
+            return
+        # Stopping the track makes the player move on to the next one
+        ctx.voice_client.stop()
+        await ctx.send(":information_source: Skipped.")
 
-        await ctx.send(f":musical_note: Now playing: {player.title}")
+    @commands.command(name="queue")
+    @commands.cooldown(1, 5, commands.BucketType.guild)
+    async def show_queue(self, ctx):
+        """Show the track that is playing and the ones after it."""
+        queue = self.players[ctx.guild.id].queue if ctx.guild.id in self.players else None
+        if queue is None or (queue.current is None and not queue.upcoming):
+            await ctx.send(":information_source: The queue is empty.")
+            return
+        lines = []
+        if queue.current is not None:
+            lines.append(f":musical_note: Now playing: {queue.current.title}")
+        lines.extend(f"`{position}.` {track.title} (requested by {track.requester.display_name})"
+                     for position, track in enumerate(queue.upcoming[:15], 1))
+        if len(queue.upcoming) > 15:
+            lines.append(f"...and {len(queue.upcoming) - 15} more")
+        await ctx.send("\n".join(lines))
+
+    @commands.command(name="nowplaying", aliases=["np"])
+    @commands.cooldown(1, 5, commands.BucketType.guild)
+    async def now_playing(self, ctx):
+        """Show the track that is playing."""
+        queue = self.players[ctx.guild.id].queue if ctx.guild.id in self.players else None
+        if queue is None or queue.current is None:
+            await ctx.send(":information_source: Nothing is playing right now.")
+            return
+        track = queue.current
+        await ctx.send(f":musical_note: Now playing: {track.title} "
+                       f"(requested by {track.requester.display_name})\n"
+                       f"{track.webpage_url or ''}")
+
+    @commands.command(name="move")
+    @commands.cooldown(1, 2, commands.BucketType.guild)
+    async def move_music(self, ctx, source: int, destination: int):
+        """Move a track in the queue to another position."""
+        queue = self.players[ctx.guild.id].queue if ctx.guild.id in self.players else None
+        try:
+            track = queue.move(source, destination)
+        except (AttributeError, IndexError):
+            raise commands.BadArgument("There is no track at that position in the queue.")
+        await ctx.send(f":information_source: Moved {track.title} to #{destination}.")
+
+    @commands.command(name="musicstats", hidden=True)
+    @commands.is_owner()
+    async def music_stats(self, ctx):
+        """Show how track lookups are answered, the CPU time streams use and the disk cache."""
+        stats = self.extractions.stats()
+        lines = [":information_source: **Lookups:** {} cached, {} hits, {} misses, {} shared\n"
+                 "**Extraction pool:** {} queued, {} running\n**Queues:** {} servers".format(
+                     stats["cached"], stats["hits"], stats["misses"], stats["shared"],
+                     stats["queued"], stats["running"], len(self.players))]
+        for mode, usage in self.stream_usage.stats().items():
+            if usage["ffmpeg_ms_per_min"] is None:
+                cpu = "no audio measured yet"
+            else:
+                cpu = "{:.0f} ms ffmpeg + {:.0f} ms bot CPU per minute of audio".format(
+                    usage["ffmpeg_ms_per_min"], usage["bot_ms_per_min"])
+            lines.append(f"**{mode.capitalize()}:** {usage['playing']} playing, "
+                         f"{usage['streams']} measured, {cpu}")
+        cache = self.audio_cache.stats()
+        hit_rate = ("no plays yet" if cache["hit_rate"] is None
+                    else "{:.0%} played from disk".format(cache["hit_rate"]))
+        lines.append("**Disk cache:** {} tracks, {:.0f}/{:.0f} MB, {} ({} hits, {} misses), "
+                     "{} evicted, {} skipped, {} downloading".format(
+                         cache["tracks"], cache["bytes"] / 1024 ** 2,
+                         cache["max_bytes"] / 1024 ** 2, hit_rate, cache["hits"],
+                         cache["misses"], cache["evictions"], cache["skipped"],
+                         cache["downloading"]))
+        await ctx.send("\n".join(lines))
 
     @play_music.before_invoke
     async def prepare_music(self, ctx):
@@ -96,21 +316,23 @@ class Music(commands.Cog):
                 # which is for the command invoker
                 self_permissions = ctx.author.voice.channel.permissions_for(ctx.me)
                 if self_permissions.connect and self_permissions.speak:
-                    await ctx.author.voice.channel.connect()
+                    await self.bot.voice_sessions.connect(ctx.author.voice.channel)
                 else:
                     raise commands.CommandError("Missing permissions to speak/connect to the voice channel.")
-
-    @play_music.after_invoke
-    async def cleanup_music(self, ctx):
-        while ctx.voice_client is not None and ctx.voice_client.is_playing():
-            await asyncio.sleep(1)
-        ctx.voice_client.stop()
+        else:
+            # Keep a connection that is waiting to disconnect
+            self.bot.voice_sessions.cancel_idle(ctx.guild.id)
 
     @play_music.error
     async def play_music_error(self, ctx, error):
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send(":x: No URL was found.")
 
+    @move_music.error
+    async def move_music_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(":x: Both positions are needed, e.g. `move 3 1`.")
+
 
 def setup(bot):
     """Adds this module in as a cog to Pingu."""
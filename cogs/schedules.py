@@ -1,287 +1,429 @@
 """This module houses an alternative to the official NJIT course catalog browser."""
 import asyncio
-import json
+import functools
+import hashlib
 import logging
 import os
+import textwrap
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
 import aiofiles
 import aiohttp
+import asyncpg
+import discord
 from discord.ext import commands, tasks
 from prettytable import PrettyTable, PLAIN_COLUMNS
 
+import settings
+from cogs.utils import (catalog, fetcher, paginator, schedule_store, snapshot, timetable,
+                        workers)
+
+
+def section_table(sections, course_codes=None) -> PrettyTable:
+    """Creates the table used to display sections.
+    Instructors are wrapped here instead of by PrettyTable so that rows can be paginated.
+
+    :param sections: The sections to display
+    :param course_codes: The course of each section, which adds a column if given
+    :return: The table with one row per section
+    :rtype: PrettyTable
+    """
+    unknown = "<Unassigned>"
+    instructor_column_size = max(len(section.instructor.split(",", 1)[0])
+                                 for section in sections) + 1
+    instructor_column_size = max(instructor_column_size, len(unknown))
+    schedule_display = PrettyTable()
+    schedule_display.set_style(PLAIN_COLUMNS)
+    schedule_display.field_names = (["COURSE"] if course_codes is not None else []) + [
+        "SEC", "INSTRUCTOR", "SEATS", "TYPE", "MEETING TIMES"]
+    schedule_display.align["SEATS"] = "l"
+    schedule_display.align["MEETING TIMES"] = "r"
+    schedule_display.left_padding_width = 1
+    schedule_display.right_padding_width = 1
+
+    # Process each section and add it to the table
+    for position, section in enumerate(sections):
+        instructor = section.instructor if section.instructor != ", " else unknown
+        row = [section.section,
+               textwrap.fill(instructor, instructor_column_size),
+               f"{section.enrolled}/{section.capacity}",
+               section.method,
+               section.meeting_times]
+        if course_codes is not None:
+            row.insert(0, course_codes[position])
+        schedule_display.add_row(row)
+    return schedule_display
+
 
 class Schedules(commands.Cog):
     """Information about courses at NJIT"""
     def __init__(self, bot):
         self.bot = bot
         self.base_endpoint = "https://uisnetpr01.njit.edu/courseschedule/alltitlecourselist.aspx?term=" # pylint: disable=line-too-long
-        self.current_semester = None
-        self.schedule_data = None
-        self.semester_codes = None
+        self.index = None
+        self.store = None  # Set when schedule data is stored in PostgreSQL instead of memory
+        self.watch_store = None
+        self.session = None
+        self.fetcher = None
+        self.workers = workers.WorkerPool(max_workers=1)
+        # Builds have their own workers, so they never wait behind a catalog refresh
+        self.build_workers = workers.WorkerPool(max_workers=settings.SCHEDULE_BUILD_WORKERS)
+        self.payload_hashes = {}  # Cache file -> hash of the payload currently loaded in memory
+        self.render_cache = paginator.RenderCache()
+        self.search_indexes = {}  # Semester code -> search.SearchIndex
+        self.instructor_indexes = {}  # Semester code -> search.InstructorIndex
+        self.watches = None  # (semester code, course code, section) -> user IDs
+        self.watched_seats = {}  # Same keys -> (enrolled, capacity) as of the last refresh
         self.schedule_updater.add_exception_type(FileNotFoundError) # pylint: disable=no-member
+        # A failed query is retried on the next attempt instead of stopping the updater for good
+        self.schedule_updater.add_exception_type( # pylint: disable=no-member
+            asyncpg.PostgresError, asyncpg.InterfaceError)
         self.schedule_updater.start() # pylint: disable=no-member
         self.log = logging.getLogger(__name__)
 
     def cog_unload(self):
         self.schedule_updater.cancel() # pylint: disable=no-member
+        self.workers.shutdown()
+        self.build_workers.shutdown()
         self.log.info("Cog unloaded; schedule updater no longer running")
 
     @tasks.loop(minutes=15)
     async def schedule_updater(self):
-        """Retrieves schedule data from the current and previous semester."""
-
-        async def update_cache_file(filename: str, endpoint: str) -> None:
-            """Updates the requested cache file with the latest response from the endpoint.
-
-            :param str filename: Location of the cache file
-            :param str endpoint: URL to request the cache from
-            """
-            try:
-                timeout = aiohttp.ClientTimeout(total=30)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(endpoint) as response:
-                        if response.status == 200:
-                            data = await response.text()
-                            data = data[7:-1]  # Trim off "define( ... )" that surrounds the JSON
-                            async with aiofiles.open(filename, "w") as cache_file:
-                                await cache_file.write(data)
-                        else:
-                            self.log.error(
-                                "Could not retrieve data for '%s'; endpoint responded with HTTP %s",
-                                filename,
-                                response.status)
-            except Exception as exc: # pylint: disable=broad-except
-                self.log.error("Could not update cache file: %s: %s", type(exc).__name__, exc)
-            else:
-                self.log.info("Cache file '%s' updated with latest data", filename)
+        """Retrieves schedule data from the current semester and the ones before it."""
 
-        async def check_cache_file(filename: str, endpoint: str) -> None:
+        async def check_cache_file(filename: str, endpoint: str):
             """Check the state of the cache file on disk, then perform actions as necessary.
 
             :param str filename: Location of the cache file
             :param str endpoint: URL to request the cache from
+            :return: The payload if it changed since it was last loaded, otherwise None
+            :rtype: str
             """
-            if os.path.exists(filename):
-                now = datetime.now()
-                cache_file_time = datetime.fromtimestamp(os.path.getmtime(filename))
-                last_updated = (now - cache_file_time).total_seconds()
-                # print(last_updated)
-                # Only send a request if the cached file is an hour old or older (3600+ seconds)
-                if last_updated >= 3600:
-                    self.log.info("Cache file '%s' is stale; updating schedule data", filename)
-                    await update_cache_file(filename, endpoint)
-                else:
-                    self.log.info("Cache file '%s' is too fresh; keeping current schedule data",
-                                  filename)
-            else:
+            if not os.path.exists(filename):
                 self.log.info("Cache file '%s' not found; downloading schedule data", filename)
-                await update_cache_file(filename, endpoint)
-
-        async def update_cache_memory(filename: str, memory_location: str) -> None:
-            """Load and parse a cache file into memory.
+                return await self.fetcher.fetch(filename, endpoint)
+
+            # A file that is not loaded could be damaged or failed to load after it was
+            # downloaded, so it is downloaded again instead of being revalidated
+            if filename not in self.payload_hashes:
+                self.log.info("Cache file '%s' is not loaded; downloading schedule data", filename)
+                return await self.fetcher.fetch(filename, endpoint, conditional=False)
+
+            # Servers that send validators are asked on every run since an unchanged catalog
+            # only costs a 304. Otherwise, only send a request if the cached file is an hour old
+            last_updated = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(filename)))
+            if self.fetcher.has_validators(endpoint):
+                return await self.fetcher.fetch(filename, endpoint)
+            if last_updated.total_seconds() >= 3600:
+                self.log.info("Cache file '%s' is stale; updating schedule data", filename)
+                return await self.fetcher.fetch(filename, endpoint)
+            self.log.info("Cache file '%s' is too fresh; keeping current schedule data", filename)
+            return None
+
+        async def update_cache_memory(filename: str, data: str, memory_location: str) -> None:
+            """Swap the course index of a payload into memory.
+            Payloads that are identical to the one already loaded are skipped, and the binary
+            snapshot next to the cache file is only rebuilt when the payload has changed.
 
             :param str filename: Location of the cache file
-            :param str memory_location: The key used to store the data in memory
+            :param str data: The JSON payload of the cache file
+            :param str memory_location: The semester code the data belongs to
             """
-            async with aiofiles.open(filename, "r") as cache_file:
-                # json.loads requires bytes/string data
-                # json.load requires a file object
-                data = await cache_file.read()
-                if self.schedule_data is None:
-                    self.schedule_data = {memory_location: json.loads(data)}
-                else:
-                    self.schedule_data[memory_location] = json.loads(data)
-                self.log.debug("Cache file '%s' loaded into '%s'", filename, memory_location)
+            payload_hash = hashlib.sha256(data.encode()).hexdigest()
+            if self.payload_hashes.get(filename) == payload_hash:
+                self.log.debug("Cache file '%s' is identical to the loaded data", filename)
+                return
+
+            snapshot_filename = snapshot.snapshot_filename(filename)
+            try:
+                loaded = snapshot.load_snapshot(snapshot_filename, payload_hash)
+            except snapshot.SnapshotError as exc:
+                self.log.info("Rebuilding snapshot: %s", exc)
+                # Parsing multi-megabyte catalogs on the event loop would stall the gateway
+                await self.workers.run(snapshot.build_snapshot, data, snapshot_filename,
+                                       payload_hash)
+                loaded = snapshot.load_snapshot(snapshot_filename, payload_hash)
+
+            current_semester = semester_codes = None
+            if memory_location == "latest":
+                # Refresh the semester code lookup table and use the actual current semester code
+                memory_location = current_semester = loaded.current_semester
+                semester_codes = loaded.semester_codes
+                self.log.debug("Semester code table refreshed (current semester is '%s')",
+                               memory_location)
+
+            # Everything derived from the sections is built in the worker process as well,
+            # since it has to decode every section of the semester
+            if self.store is not None:
+                # Sections are only kept in the database, which swaps them in as a whole
+                sections_filename = f"{snapshot_filename}.csv"
+                try:
+                    await self.workers.run(
+                        snapshot.derive_from_snapshot, snapshot_filename, payload_hash,
+                        functools.partial(schedule_store.write_sections, sections_filename,
+                                          memory_location))
+                    await self.store.ingest(memory_location, payload_hash, sections_filename,
+                                            current_semester=current_semester,
+                                            semester_codes=semester_codes)
+                finally:
+                    if os.path.exists(sections_filename):
+                        os.remove(sections_filename)
+                course_index = {}
+            else:
+                course_index = loaded.courses
+                (self.search_indexes[memory_location],
+                 self.instructor_indexes[memory_location]) = await self.workers.run(
+                     snapshot.derive_from_snapshot, snapshot_filename, payload_hash,
+                     snapshot.build_indexes)
+            self.index = (self.index or catalog.ScheduleIndex()).with_semester(
+                memory_location, course_index, version=payload_hash,
+                current_semester=current_semester, semester_codes=semester_codes)
+            self.render_cache.invalidate(memory_location)
+            self.payload_hashes[filename] = payload_hash
+            self.log.debug("Cache file '%s' loaded into '%s'", filename, memory_location)
 
         async def update_cache(filename: str, endpoint: str, memory_location: str) -> None:
             """Helper function that combines all of the previous subroutines.
-            Also updates the semester code table and moves the "latest" cache file
-            to its correct location.
+            Each semester is loaded as soon as it arrives, and a failure only affects itself.
 
             :param str filename: Location of the cache file
             :param str endpoint: URL to request the cache from
-            :param str memory_location: The key specifying where to store the JSON in memory
+            :param str memory_location: The semester code the data belongs to
             """
-            await check_cache_file(filename, endpoint)
-            await update_cache_memory(filename, memory_location)
-            if memory_location == "latest":
-                # Refresh the semester code lookup table
-                loaded_semesters = self.schedule_data[memory_location]["ts"]["WSRESPONSE"]["SOAXREF"] # pylint: disable=line-too-long
-                self.current_semester = str(self.schedule_data[memory_location]["ct"])
-                self.semester_codes = {semester["EDIVALUE"]: semester["DESCRIPTION"].lower()
-                                       for semester in loaded_semesters}
-                self.log.debug("Semester code table refreshed (current semester is '%s')",
-                               self.current_semester)
-
-                # Replace the "latest" key with the actual current semester code
-                self.schedule_data[self.current_semester] = self.schedule_data.pop(memory_location)
+            try:
+                async with fetch_limit:
+                    data = await check_cache_file(filename, endpoint)
+                if data is not None:
+                    await update_cache_memory(filename, data, memory_location)
+            except Exception as exc: # pylint: disable=broad-except
+                self.log.error("Could not load schedule data for '%s': %s: %s",
+                               memory_location, type(exc).__name__, exc)
 
-        # Retrieve the schedule data for the current semester
-        base_dirname, base_filename = "cache", "scheduledata.json"
-        latest_semester_code = "latest"
-        latest_semester_filename = f"{base_dirname}/{latest_semester_code}-{base_filename}"
-        await update_cache(latest_semester_filename, self.base_endpoint, latest_semester_code)
+        async def load_cache_file(filename: str, memory_location: str) -> None:
+            """Loads a cache file from disk without asking the server about it first.
 
-        # Retrieve the schedule data for the previous semester
-        loaded_semesters = self.schedule_data[self.current_semester]["ts"]["WSRESPONSE"]["SOAXREF"]
-        prev_semester_code = max(sem["EDIVALUE"] for sem in loaded_semesters
-                                 if sem["EDIVALUE"] != self.current_semester)
-        prev_semester_endpoint = f"{self.base_endpoint}{prev_semester_code}"
-        prev_semester_filename = f"{base_dirname}/{prev_semester_code}-{base_filename}"
-        await update_cache(prev_semester_filename, prev_semester_endpoint, prev_semester_code)
+            :param str filename: Location of the cache file
+            :param str memory_location: The semester code the data belongs to
+            """
+            if filename in self.payload_hashes or not os.path.exists(filename):
+                return
+            try:
+                async with aiofiles.open(filename, "r") as cache_file:
+                    data = await cache_file.read()
+                await update_cache_memory(filename, data, memory_location)
+            except Exception as exc: # pylint: disable=broad-except
+                self.log.error("Could not load cached schedule data for '%s': %s: %s",
+                               memory_location, type(exc).__name__, exc)
+
+        def cache_location(semester_code: str):
+            """Returns the cache file and endpoint of a semester."""
+            if semester_code == "latest":
+                return "cache/latest-scheduledata.json", self.base_endpoint
+            return f"cache/{semester_code}-scheduledata.json", f"{self.base_endpoint}{semester_code}"
+
+        def previous_semesters(index: catalog.ScheduleIndex) -> list:
+            """Returns the semesters to load alongside the current one."""
+            return sorted((code for code in index.semester_codes if code != index.current_semester),
+                          reverse=True)[:settings.SCHEDULE_SEMESTERS - 1]
+
+        async def update_all() -> None:
+            """Retrieves and loads every semester that should be kept."""
+            # The semester code table comes from the current semester, so it has to be retrieved
+            # first unless a previous run already loaded it. Then every semester is fetched at once
+            semesters = ["latest"]
+            if self.index is None:
+                # Whatever is on disk is served right away, even if the server is slow or down,
+                # and only revalidated afterwards
+                await load_cache_file(cache_location("latest")[0], "latest")
+                if self.index is not None:
+                    await asyncio.gather(*(load_cache_file(cache_location(code)[0], code)
+                                           for code in previous_semesters(self.index)))
+                else:
+                    await update_cache(*cache_location("latest"), "latest")
+                    semesters = []
+            if self.index is None:
+                raise FileNotFoundError("Schedule data for the current semester is unavailable")
+            semesters.extend(previous_semesters(self.index))
+            await asyncio.gather(*(update_cache(*cache_location(code), code)
+                                   for code in semesters))
+
+            # Drop semesters that are no longer among the most recent ones
+            retained = [self.index.current_semester] + previous_semesters(self.index)
+            self.index = self.index.retain_semesters(retained)
+            if self.store is not None:
+                await self.store.retain_semesters(retained)
+
+        fetch_limit = asyncio.Semaphore(settings.SCHEDULE_FETCH_LIMIT)
+        if self.store is None:
+            await update_all()
+        else:
+            # Only one process downloads and ingests the catalog, and the others read its results
+            async with self.store.refresh_lock() as refreshing:
+                if refreshing:
+                    await update_all()
+                else:
+                    index = await self.store.load_index()
+                    for semester_code, version in index.versions.items():
+                        if self.index is None or self.index.versions.get(semester_code) != version:
+                            self.render_cache.invalidate(semester_code)
+                    self.index = index
+        self.search_indexes = {code: search_index
+                               for code, search_index in self.search_indexes.items()
+                               if code in self.index.courses}
+        self.instructor_indexes = {code: instructor_index
+                                   for code, instructor_index in self.instructor_indexes.items()
+                                   if code in self.index.courses}
+        # Only one process sends DMs, or every watcher would get one from each process
+        try:
+            notifying = await self.watch_store.claim_notifier()
+        except Exception as exc: # pylint: disable=broad-except
+            self.log.error("Could not check which process notifies watchers: %s: %s",
+                           type(exc).__name__, exc)
+            notifying = False
+        if notifying:
+            # Watches can be added through any process, so they are read again before every check
+            await self.load_watches()
+            await self.notify_watchers()
 
     @schedule_updater.before_loop
     async def prepare_updater(self):
-        """Delay schedule updater until the bot is in the ready state."""
+        """Delay schedule updater until the bot is in the ready state.
+        The HTTP session is shared by every request the updater makes.
+        """
         await self.bot.wait_until_ready()
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+            self.fetcher = fetcher.CacheFileFetcher(self.session)
+        if settings.SCHEDULE_STORAGE == "postgres" and self.store is None:
+            self.store = schedule_store.PostgresScheduleStore(self.bot.db)
+            await self.store.create_tables()
+        if self.watch_store is None:
+            self.watch_store = schedule_store.SectionWatches(self.bot.db)
+        if self.watches is None:
+            await self.load_watches()
+
+    async def load_watches(self) -> None:
+        """Reads every watched section from the database.
+        The watches that were read last are kept if the database cannot be reached.
+        """
+        try:
+            watches = await self.watch_store.load()
+        except Exception as exc: # pylint: disable=broad-except
+            self.log.error("Could not load watchlists: %s: %s", type(exc).__name__, exc)
+            return
+        if self.watches is None:
+            self.log.info("Loaded %s watched sections", len(watches))
+        self.watches = watches
+
+    async def notify_watchers(self) -> None:
+        """Compares the seats of every watched section against the previous refresh, then sends
+        each watcher a single DM that lists all of their sections that opened up.
+        Only watched sections are compared, so the work does not grow with the catalog.
+        """
+        if not self.watches:
+            return
+        seats = await self.seat_counts(self.watches)
+        opened = {}  # User ID -> [(semester code, course code, section, enrolled, capacity)]
+        for key, (enrolled, capacity) in seats.items():
+            previous = self.watched_seats.get(key)
+            if previous is not None and previous[0] >= previous[1] and enrolled < capacity:
+                for user_id in self.watches[key]:
+                    opened.setdefault(user_id, []).append(key + (enrolled, capacity))
+        self.watched_seats = seats
+
+        for user_id, sections in opened.items():
+            lines = "\n".join(
+                f"`{course_code}-{section}` ({self.index.semester_codes[semester_code].title()}): "
+                f"{enrolled}/{capacity} seats taken"
+                for semester_code, course_code, section, enrolled, capacity in sections)
+            try:
+                user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+                await user.send(f":bell: Seats opened up in sections you are watching:\n{lines}")
+            except discord.HTTPException as exc:
+                self.log.error("Could not notify watcher %s: %s: %s",
+                               user_id, type(exc).__name__, exc)
+        if opened:
+            self.log.info("Notified %s watchers of opened sections", len(opened))
 
     # .after_loop only runs after the task is completely finished (and not looping)
     @schedule_updater.after_loop
     async def cleanup_updater(self):
         """Unload cached data from memory when the tasks ends."""
         if self.schedule_updater.is_being_cancelled(): # pylint: disable=no-member
-            self.current_semester = None
-            self.schedule_data = None
-            self.semester_codes = None
+            self.index = None
+            self.store = None
+            self.fetcher = None
+            self.payload_hashes = {}
+            self.search_indexes = {}
+            self.instructor_indexes = {}
+            self.render_cache.invalidate()
+            if self.session is not None:
+                await self.session.close()
+                self.session = None
+            if self.watch_store is not None:
+                await self.watch_store.release_notifier()
             self.log.debug("Cleared cached data from memory")
 
-    @commands.command(name="course")
+    def loaded_index(self) -> catalog.ScheduleIndex:
+        """Ensure that the schedule data has been retrieved and is loaded in memory."""
+        index = self.index
+        if index is None or len(index) == 0:
+            raise commands.BadArgument("Schedule data not available. Try again in a few seconds.")
+        return index
+
+    async def get_sections(self, index: catalog.ScheduleIndex, semester_code: str,
+                           course_code: str) -> tuple:
+        """Retrieves the sections of a course from memory or from the database."""
+        if self.store is not None:
+            return await self.store.get_sections(semester_code, course_code)
+        return index.get_sections(semester_code, course_code)
+
+    async def seat_counts(self, keys) -> dict:
+        """Retrieves the (enrolled, capacity) of specific sections from memory or the database."""
+        if self.store is not None:
+            return await self.store.seat_counts(keys)
+        return catalog.seat_counts(self.index, keys)
+
+    @commands.group(name="course", invoke_without_command=True)
     @commands.cooldown(rate=1, per=5.0, type=commands.BucketType.member)
     async def get_course(self, ctx, req_course: str, *, req_semester: str = None):
         """Retrieves information about a course based on the semester"""
-        # Ensure that the schedule data has been retrieved and is loaded in memory
-        if self.schedule_data is None or len(self.schedule_data) == 0:
-            raise commands.BadArgument("Schedule data not available. Try again in a few seconds.")
+        index = self.loaded_index()
 
         # Check the requested semester is valid
         # If not specified, default to current semester
         selected_course = req_course.upper()
-        if req_semester is not None:
-            selected_semester = req_semester.lower()
-            codes_reversed = dict((desc, code) for code, desc in self.semester_codes.items())
-            if selected_semester not in codes_reversed:
-                raise commands.BadArgument("Requested semester does not exist.")
-            selected_semester = codes_reversed[selected_semester]
-        else:
-            selected_semester = self.current_semester
+        selected_semester = index.resolve_semester(req_semester)
+        if selected_semester is None:
+            raise commands.BadArgument("Requested semester does not exist.")
         self.log.debug("'%s' (%s) was selected",
-                       self.semester_codes[selected_semester],
+                       index.semester_codes[selected_semester],
                        selected_semester)
 
-        def get_sections(semester_code: str, selected_course: str):
-            """Retrieves all of the matching sections for a given course in a single list
-
-            :param str semester_code: The semester to retrieve the schedule data from
-            :param str selected_course: The course to look for in the semester data
-            :return: All of the matching sections of a course in that semester
-            :rtype: list
-            """
-            selected_prefix = selected_course[:-3]
-            semester_data = self.schedule_data[semester_code]["ws"]["WSRESPONSE"]["Subject"]
-
-            # Unpack the inner list from the outer list
-            # If the course does not exist, return an empty list
-            [matching_courses] = [subject["Course"] for subject in semester_data
-                                  if selected_prefix == subject["SUBJ"]] or [[]]
-            matching_sections = [course["Section"] for course in matching_courses
-                                 if selected_course == course["COURSE"]]
-
-            # Reformat all matches into a single list
-            matches = []
-            for section in matching_sections:
-                if isinstance(section, list):
-                    matches.extend(section)  # List of sections
-                elif isinstance(section, dict):
-                    matches.append(section)  # Single section
-                else:
-                    self.log.error("An unknown data structure was parsed for %s - %s",
-                                   selected_course,
-                                   section)
-            return matches
-
-        # Error check if the course exists for that semester
-        course_sections = get_sections(selected_semester, selected_course)
-        if len(course_sections) == 0:
-            raise commands.BadArgument("Specified course was not found.")
-
-        # Create and format the table
-        unknown = "<Unassigned>"
-        instructor_column_size = max(len(section["INSTRUCTOR"].split(",", 1)[0])
-                                     for section in course_sections) + 1
-        schedule_display = PrettyTable()
-        schedule_display.set_style(PLAIN_COLUMNS)
-        schedule_display.field_names = ["SEC", "INSTRUCTOR", "SEATS", "TYPE", "MEETING TIMES"]
-        schedule_display.align["SEATS"] = "l"
-        schedule_display.align["MEETING TIMES"] = "r"
-        schedule_display.left_padding_width = 1
-        schedule_display.right_padding_width = 1
-        schedule_display._max_width = {"INSTRUCTOR": instructor_column_size # pylint: disable=protected-access
-                                                     if instructor_column_size >= len(unknown)
-                                                     else len(unknown)}
-
-        # Create the table header
-        course_titles = set(section["TITLE"] for section in course_sections
-                            if "honors" not in section["TITLE"].lower())
-        header = ":calendar_spiral: {} - {} ({})\n".format(
-            self.semester_codes[selected_semester].title(),
-            selected_course,
-            " / ".join(course_titles))
-
-        def process_meeting_times(data):
-            """Helper function that formats the meeting time hours of a section."""
-            output = "-------------"
-            # Format times to standard 12-hour instead of 24-hour
-            if isinstance(data, list):
-                output = "\n".join(
-                    f"{meeting['MTG_DAYS']}: "
-                    f"{datetime.strptime(meeting['START_TIME'], '%H%M').strftime('%I:%M %p')} - "
-                    f"{datetime.strptime(meeting['END_TIME'], '%H%M').strftime('%I:%M %p')}"
-                    for meeting in data)
-            elif isinstance(data, dict) and len(data) > 1:
-                output = (f"{data['MTG_DAYS']}: "
-                          f"{datetime.strptime(data['START_TIME'], '%H%M').strftime('%I:%M %p')} - "
-                          f"{datetime.strptime(data['END_TIME'], '%H%M').strftime('%I:%M %p')}")
-            return output
-
-        # Process each section and add it to the table
-        for section in course_sections:
-            instructor = section["INSTRUCTOR"] if section["INSTRUCTOR"] != ", " else unknown
-            seats = f'{section["ENROLLED"]}/{section["CAPACITY"]}'
-            meeting_times = process_meeting_times(
-                section["Schedule"] if "Schedule" in section else None)
-            schedule_display.add_row([section["SECTION"],
-                                      instructor,
-                                      seats,
-                                      section["INSTRUCTIONMETHOD"],
-                                      meeting_times])
-
-        def shrink_header(table: PrettyTable, start: int, lines: int):
-            """nap told me to fix this"""
-            output = f"```{table.get_string(start=start, end=start+lines)}```"
-            while len(output) > 2000:
-                lines -= 1
-                output = f"```{table.get_string(start=start, end=start+lines)}```"
-            return output, lines
-
-        def shrink_body(table: PrettyTable, start: int, lines: int):
-            """this one too"""
-            output = f"```{table.get_string(start=start, end=start+lines, header=False)}```"
-            while len(output) > 2000:
-                lines -= 1
-                output = f"```{table.get_string(start=start, end=start+lines, header=False)}```"
-            return output, lines
+        # Popular courses are served straight from the render cache
+        cache_key = (selected_semester, selected_course, index.versions.get(selected_semester))
+        rendered = self.render_cache.get(cache_key)
+        if rendered is None:
+            # Error check if the course exists for that semester
+            course_sections = await self.get_sections(index, selected_semester, selected_course)
+            if len(course_sections) == 0:
+                raise commands.BadArgument("Specified course was not found.")
+            course_titles = set(section.title for section in course_sections
+                                if "honors" not in section.title.lower())
+            header = ":calendar_spiral: {} - {} ({})\n".format(
+                index.semester_codes[selected_semester].title(),
+                selected_course,
+                " / ".join(course_titles))
+            rendered = (header, paginator.paginate_table(section_table(course_sections)))
+            self.render_cache.put(cache_key, rendered)
 
         # Paginate table output because of Discord's 2000 character limit per message
+        header, pages = rendered
         await ctx.send(header)
-        max_lines = 20
-        counter = 0
-        output, max_lines = shrink_header(schedule_display, counter, max_lines)
-        while len(output) > 6:
-            await ctx.send(output)
+        for page in pages:
+            await ctx.send(page)
             await asyncio.sleep(1)
-            counter += max_lines
-            output, max_lines = shrink_body(schedule_display, counter, max_lines)
 
     @get_course.error
     async def get_course_error(self, ctx, error):
@@ -289,6 +431,225 @@ class Schedules(commands.Cog):
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send(f"{self.bot.icons['fail']} No course number was specified.")
 
+    @get_course.command(name="search")
+    @commands.cooldown(rate=1, per=5.0, type=commands.BucketType.user)
+    async def search_courses(self, ctx, *, text: str):
+        """Finds courses by partial course code or title, even with typos"""
+        index = self.loaded_index()
+
+        # Merge the results of every loaded semester, keeping the order of the first match
+        results = {}
+        for semester_code in sorted(index.courses, reverse=True):
+            if self.store is not None:
+                matches = await self.store.search_courses(semester_code, text)
+            else:
+                matches = self.search_indexes[semester_code].search(text)
+            for course_code, title in matches:
+                semesters = results.setdefault(course_code, (title, []))[1]
+                semesters.append(index.semester_codes[semester_code].title())
+        if len(results) == 0:
+            raise commands.BadArgument("No courses matched the search.")
+
+        results_display = PrettyTable()
+        results_display.set_style(PLAIN_COLUMNS)
+        results_display.field_names = ["COURSE", "TITLE", "SEMESTERS"]
+        results_display.align = "l"
+        results_display.left_padding_width = 1
+        results_display.right_padding_width = 1
+        for course_code, (title, semesters) in list(results.items())[:25]:
+            results_display.add_row([course_code, title, ", ".join(semesters)])
+        await ctx.send(f":mag: Courses matching `{text}`")
+        for page in paginator.paginate_table(results_display):
+            await ctx.send(page)
+
+    @search_courses.error
+    async def search_courses_error(self, ctx, error):
+        """Error checking the parameters of the search_courses command."""
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(f"{self.bot.icons['fail']} Nothing was given to search for.")
+
+    async def find_section(self, req_course: str, req_section: str,
+                           req_semester: str = None) -> tuple:
+        """Looks up a section from command arguments.
+
+        :return: The (semester code, course code, section) key of the section
+        :rtype: tuple
+        """
+        index = self.loaded_index()
+        selected_semester = index.resolve_semester(req_semester)
+        if selected_semester is None:
+            raise commands.BadArgument("Requested semester does not exist.")
+        selected_course = req_course.upper()
+        sections = [section.section for section in await self.get_sections(
+            index, selected_semester, selected_course)]
+        if len(sections) == 0:
+            raise commands.BadArgument("Specified course was not found.")
+        selected_section = req_section.upper()
+        if selected_section.isdigit():
+            selected_section = selected_section.zfill(3)
+        if selected_section not in sections:
+            raise commands.BadArgument("Specified section was not found.")
+        return selected_semester, selected_course, selected_section
+
+    @get_course.command(name="watch")
+    @commands.cooldown(rate=1, per=5.0, type=commands.BucketType.user)
+    async def watch_section(self, ctx, req_course: str, req_section: str, *,
+                            req_semester: str = None):
+        """Get a DM when a seat opens up in a section"""
+        if self.watches is None:
+            raise commands.BadArgument("Watchlists are not available. Try again in a few seconds.")
+        key = await self.find_section(req_course, req_section, req_semester)
+        await self.watch_store.add(ctx.author.id, key)
+        self.watches.setdefault(key, set()).add(ctx.author.id)
+        self.watched_seats.update(await self.seat_counts([key]))
+        await ctx.send(f"{self.bot.icons['success']} You will be sent a DM when a seat opens up "
+                       f"in `{key[1]}-{key[2]}`.")
+
+    @get_course.command(name="unwatch")
+    @commands.cooldown(rate=1, per=5.0, type=commands.BucketType.user)
+    async def unwatch_section(self, ctx, req_course: str, req_section: str, *,
+                              req_semester: str = None):
+        """Stop watching a section"""
+        if self.watches is None:
+            raise commands.BadArgument("Watchlists are not available. Try again in a few seconds.")
+        key = await self.find_section(req_course, req_section, req_semester)
+        if ctx.author.id not in self.watches.get(key, ()):
+            raise commands.BadArgument("You are not watching that section.")
+        await self.watch_store.remove(ctx.author.id, key)
+        self.watches[key].discard(ctx.author.id)
+        if not self.watches[key]:
+            del self.watches[key]
+            self.watched_seats.pop(key, None)
+        await ctx.send(f"{self.bot.icons['success']} No longer watching `{key[1]}-{key[2]}`.")
+
+    @watch_section.error
+    @unwatch_section.error
+    async def watch_section_error(self, ctx, error):
+        """Error checking the parameters of the watch_section and unwatch_section commands."""
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(f"{self.bot.icons['fail']} A course and section must be specified.")
+
+    @commands.command(name="instructor")
+    @commands.cooldown(rate=1, per=5.0, type=commands.BucketType.member)
+    async def get_instructor(self, ctx, name: str, *, req_semester: str = None):
+        """Lists the sections an instructor teaches (use quotes for full names)"""
+        index = self.loaded_index()
+        selected_semester = index.resolve_semester(req_semester)
+        if selected_semester is None or selected_semester not in index.courses:
+            raise commands.BadArgument("Requested semester does not exist.")
+
+        course_codes, sections = [], []
+        if self.store is not None:
+            for course_code, section in await self.store.instructor_sections(selected_semester,
+                                                                             name):
+                course_codes.append(course_code)
+                sections.append(section)
+            instructor_names = list(dict.fromkeys(section.instructor for section in sections))
+        else:
+            instructor_index = self.instructor_indexes[selected_semester]
+            matching_names = instructor_index.search(name)
+            instructor_names = [instructor_index.names[matching_name]
+                                for matching_name in matching_names]
+            # Sections are stored by position, so decode each course once
+            decoded = {}
+            course_index = index.courses[selected_semester]
+            for matching_name in matching_names:
+                codes, positions = instructor_index.sections[matching_name]
+                for course_code, position in zip(codes, positions):
+                    if course_code not in decoded:
+                        decoded[course_code] = course_index[course_code]
+                    course_codes.append(course_code)
+                    sections.append(decoded[course_code][position])
+        if len(sections) == 0:
+            raise commands.BadArgument("No instructor with that name was found.")
+
+        header = ":calendar_spiral: {} - {}\n".format(
+            index.semester_codes[selected_semester].title(), " / ".join(instructor_names))
+        await ctx.send(header)
+        for page in paginator.paginate_table(section_table(sections, course_codes)):
+            await ctx.send(page)
+            await asyncio.sleep(1)
+
+    @get_instructor.error
+    async def get_instructor_error(self, ctx, error):
+        """Error checking the parameters of the get_instructor command."""
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(f"{self.bot.icons['fail']} No instructor was specified.")
+
+    @commands.group(name="schedule")
+    async def schedule(self, ctx):
+        """Plans a semester's schedule"""
+        if ctx.invoked_subcommand is None:
+            raise commands.BadArgument("Try `schedule build <course>, <course>, ...`.")
+
+    @schedule.command(name="build")
+    @commands.cooldown(rate=1, per=10.0, type=commands.BucketType.member)
+    async def build_schedule(self, ctx, *, req_courses: str):
+        """Finds every combination of sections without time conflicts (e.g. CS 280, MATH 211)"""
+        index = self.loaded_index()
+        selected_semester = index.current_semester
+        selected_courses = list(dict.fromkeys(course.replace(" ", "").upper()
+                                              for course in req_courses.split(",")
+                                              if course.strip()))
+        if not 2 <= len(selected_courses) <= settings.SCHEDULE_BUILD_COURSES:
+            raise commands.BadArgument(
+                f"Between 2 and {settings.SCHEDULE_BUILD_COURSES} courses can be scheduled.")
+        # Only the requested courses are decoded and grouped by their meeting times
+        course_index = {}
+        for course in selected_courses:
+            sections = await self.get_sections(index, selected_semester, course)
+            if sections:
+                course_index[course] = sections
+        timetable_index = timetable.build_timetable_index(course_index)
+        missing_courses = [course for course in selected_courses if course not in timetable_index]
+        if missing_courses:
+            raise commands.BadArgument(f"`{'`, `'.join(missing_courses)}` could not be found.")
+
+        # The search is CPU bound, so it runs in a worker process with a hard time budget.
+        # The budget only starts once a worker picks the build up, so waiting is limited as well
+        async with ctx.typing():
+            try:
+                results = await asyncio.wait_for(
+                    self.build_workers.run(
+                        timetable.build_schedules,
+                        [(course, timetable_index[course]) for course in selected_courses],
+                        10, settings.SCHEDULE_BUILD_BUDGET),
+                    settings.SCHEDULE_BUILD_BUDGET + settings.SCHEDULE_BUILD_WAIT)
+            except asyncio.TimeoutError:
+                raise commands.BadArgument(
+                    "Too many schedules are being built right now. Try again later.") from None
+            except BrokenProcessPool:
+                raise commands.BadArgument(
+                    "Something went wrong while building schedules. Try again.") from None
+        if not results["schedules"]:
+            raise commands.BadArgument("Every combination of those courses has a time conflict.")
+
+        schedules_display = PrettyTable()
+        schedules_display.set_style(PLAIN_COLUMNS)
+        schedules_display.field_names = ["#", "DAYS", "GAPS"] + selected_courses
+        schedules_display.left_padding_width = 1
+        schedules_display.right_padding_width = 1
+        for rank, (days, gaps, chosen) in enumerate(results["schedules"], 1):
+            sections = dict(chosen)
+            schedules_display.add_row(
+                [rank, days, f"{gaps // 60}h {gaps % 60:02d}m"] +
+                ["\n".join(textwrap.wrap(" ".join(sections[course]), 11))
+                 for course in selected_courses])
+
+        found = results["found"] if results["exact"] else f"at least {results['found']}"
+        await ctx.send(":calendar_spiral: {} - {} conflict-free schedules, best {} shown\n".format(
+            index.semester_codes[selected_semester].title(),
+            found,
+            len(results["schedules"])))
+        for page in paginator.paginate_table(schedules_display):
+            await ctx.send(page)
+
+    @build_schedule.error
+    async def build_schedule_error(self, ctx, error):
+        """Error checking the parameters of the build_schedule command."""
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(f"{self.bot.icons['fail']} No courses were specified.")
+
 
 def setup(bot):
     """Adds this module in as a cog to Pingu."""
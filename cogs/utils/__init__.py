@@ -0,0 +1 @@
+"""Helper modules shared by the cogs. These are not cogs and are not loaded as extensions."""
@@ -0,0 +1,227 @@
+"""This module keeps downloaded tracks on disk so that tracks which are played again are read from
+disk instead of being looked up and streamed again. Every track is stored under its extractor and
+ID as an audio file plus a small JSON file with what is needed to play it. Both are written to a
+temporary file first and then renamed into place, so a track is either cached completely or not
+at all. Once the cache is over its byte budget, the least recently played tracks are deleted.
+Live streams and tracks that would take up a large share of the budget are never downloaded.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cogs.utils.extraction import normalize_query
+
+
+UNSAFE_CHARACTERS = re.compile(r"[^\w.-]")
+TEMPORARY_PREFIX = ".tmp-"
+MAX_TRACK_SHARE = 0.1  # The largest share of the byte budget that a single track can take up
+
+
+def track_key(extractor: str, video_id: str) -> str:
+    """Turns an extractor and the ID it gave a track into a key that is safe as a file name."""
+    return UNSAFE_CHARACTERS.sub("_", f"{extractor.lower()}-{video_id}")
+
+
+def estimate_size(data: dict):
+    """Estimates how many bytes a track takes up from the information extracted for it.
+
+    :param dict data: The extracted information of the track
+    :return: The size in bytes, or None if the extractor did not report enough to tell
+    :rtype: Optional[int]
+    """
+    size = data.get("filesize") or data.get("filesize_approx")
+    if size:
+        return int(size)
+    bitrate = data.get("abr") or data.get("tbr")  # In kbit/s
+    if bitrate and data.get("duration"):
+        return int(data["duration"] * bitrate * 1000 / 8)
+    return None
+
+
+def query_key(query: str):
+    """Finds the key of a URL without looking it up, which only works for YouTube videos."""
+    normalized = normalize_query(query)
+    if normalized.startswith("youtube:"):
+        return track_key("youtube", normalized.split(":", 1)[1])
+    return None
+
+
+class AudioCache:
+    """Downloaded tracks, kept within a byte budget by deleting the least recently played."""
+    def __init__(self, directory: str, max_bytes: int, download, max_workers: int = 1,
+                 max_track_share: float = MAX_TRACK_SHARE):
+        """
+        :param str directory: Where the tracks are stored
+        :param int max_bytes: How many bytes of audio to keep
+        :param download: Blocking function that downloads extracted information to a path
+        :param int max_workers: How many downloads can run at once
+        :param float max_track_share: The largest share of max_bytes a single track can take up
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_track_bytes = int(max_bytes * max_track_share)
+        self.download = download
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+        self.entries = OrderedDict()  # Key -> metadata, least recently played first
+        self.size = 0
+        self.downloads = {}  # Key -> download in progress
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0  # Tracks that were not downloaded because they are live or too large
+        self.log = logging.getLogger(__name__)
+
+    def load(self) -> None:
+        """Indexes the tracks in the directory and removes anything left over from a crash."""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(TEMPORARY_PREFIX):
+                self.remove_file(path)
+            elif name.endswith(".json"):
+                try:
+                    with open(path) as file:
+                        entry = json.load(file)
+                    entry["size"] = os.path.getsize(self.audio_path(entry))
+                except (OSError, ValueError, KeyError) as exc:
+                    self.log.error("Discarding cached track %s: %s", name, exc)
+                    self.remove_file(path)
+                    continue
+                found.append((os.path.getmtime(path), name[:-len(".json")], entry))
+
+        referenced = {entry["file"] for _, _, entry in found}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") and name not in referenced:
+                self.remove_file(os.path.join(self.directory, name))
+
+        self.entries.clear()
+        self.size = 0
+        for _, key, entry in sorted(found, key=lambda item: item[0]):
+            self.entries[key] = entry
+            self.size += entry["size"]
+        self.evict()
+
+    def audio_path(self, entry: dict) -> str:
+        return os.path.join(self.directory, entry["file"])
+
+    def metadata_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def lookup(self, key: str):
+        """Retrieves the metadata of a cached track without counting it as played."""
+        return self.entries.get(key) if key is not None else None
+
+    def get(self, key: str):
+        """Retrieves the path of a cached track that is about to be played.
+
+        :param str key: The key of the track
+        :return: The path of its audio file, or None if it is not cached
+        :rtype: Optional[str]
+        """
+        entry = self.lookup(key)
+        if entry is not None and not os.path.exists(self.audio_path(entry)):
+            # Someone deleted it from the directory
+            del self.entries[key]
+            self.size -= entry["size"]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        try:
+            # Lets the order of recently played tracks survive a restart
+            os.utime(self.metadata_path(key))
+        except OSError:
+            pass
+        return self.audio_path(entry)
+
+    def fetch(self, key: str, data: dict) -> None:
+        """Starts downloading a track in the background unless it is cached or downloading."""
+        if key in self.entries or key in self.downloads or self.max_bytes <= 0:
+            return
+        size = estimate_size(data)
+        # A live stream never ends, and a huge track would evict everything else
+        if data.get("is_live") or (size is not None and size > self.max_track_bytes):
+            self.skipped += 1
+            return
+        self.downloads[key] = asyncio.ensure_future(self.store(key, data))
+        self.downloads[key].add_done_callback(lambda _: self.downloads.pop(key, None))
+
+    async def store(self, key: str, data: dict) -> None:
+        """Downloads a track and adds it to the cache."""
+        extension = UNSAFE_CHARACTERS.sub("_", data.get("ext") or "audio")
+        temporary = os.path.join(self.directory, f"{TEMPORARY_PREFIX}{uuid.uuid4().hex}")
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.download, data,
+                                       f"{temporary}.{extension}")
+            entry = {"file": f"{key}.{extension}",
+                     "title": data.get("title"),
+                     "webpage_url": data.get("webpage_url"),
+                     "acodec": data.get("acodec")}
+            with open(f"{temporary}.json", "w") as file:
+                json.dump(entry, file)
+            # The extractor does not always report a size, so the download is checked as well
+            if os.path.getsize(f"{temporary}.{extension}") > self.max_track_bytes:
+                raise ValueError("the track is too large to cache")
+            # The audio is renamed into place first, because a track only counts as cached
+            # once its metadata exists
+            os.replace(f"{temporary}.{extension}", self.audio_path(entry))
+            os.replace(f"{temporary}.json", self.metadata_path(key))
+            entry["size"] = os.path.getsize(self.audio_path(entry))
+        except Exception as exc:  # pylint: disable=broad-except
+            self.log.error("Could not cache %s: %s", key, exc)
+            for leftover in (f"{temporary}.{extension}", f"{temporary}.{extension}.part",
+                             f"{temporary}.json"):
+                self.remove_file(leftover)
+            return
+
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous["size"]
+        self.entries[key] = entry
+        self.size += entry["size"]
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently played tracks until the cache is within its budget."""
+        while self.size > self.max_bytes and self.entries:
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry["size"]
+            self.evictions += 1
+            self.remove_file(self.metadata_path(key))
+            self.remove_file(self.audio_path(entry))
+
+    def remove_file(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            self.log.error("Could not remove %s: %s", path, exc)
+
+    def stats(self) -> dict:
+        """Summarizes how often tracks were played from disk and how full the cache is."""
+        plays = self.hits + self.misses
+        return {"tracks": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / plays if plays else None,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+                "downloading": len(self.downloads)}
+
+    def shutdown(self) -> None:
+        """Stops downloading without waiting for downloads that are running."""
+        for download in self.downloads.values():
+            download.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,280 @@
+"""This module turns the NJIT course catalog into an index that can be queried without
+touching the raw JSON. The index is built once per refresh and swapped in as a whole.
+"""
+import json
+import logging
+import sys
+from typing import NamedTuple
+
+
+log = logging.getLogger(__name__)
+NO_MEETING_TIMES = "-------------"
+MINUTES_PER_DAY = 24 * 60
+
+
+class Meeting(NamedTuple):
+    """A weekly meeting of a section. Times are stored in minutes after midnight."""
+    days: str
+    start: int
+    end: int
+
+
+class Section(NamedTuple):
+    """A compact, normalized section record. Every string is interned when it is created."""
+    section: str
+    instructor: str
+    enrolled: int
+    capacity: int
+    method: str
+    title: str
+    meetings: tuple
+    meeting_times: str
+
+
+def as_list(value) -> list:
+    """The catalog uses a single dict instead of a list when there is only one entry.
+
+    :param value: A list, a dict, or nothing at all
+    :return: The value as a list
+    :rtype: list
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        return [value]
+    return []
+
+
+def parse_time(value: str) -> int:
+    """Converts a 24-hour "HHMM" string from the catalog into minutes after midnight."""
+    value = int(value)
+    return (value // 100) * 60 + value % 100
+
+
+def format_time(minutes: int) -> str:
+    """Formats minutes after midnight as a 12-hour time (e.g. "02:30 PM")."""
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours % 12 or 12:02d}:{minutes:02d} {'AM' if hours < 12 else 'PM'}"
+
+
+def _to_int(value) -> int:
+    """Seat counts are strings in the catalog and are occasionally blank."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def normalize_meetings(schedule) -> tuple:
+    """Parses the "Schedule" field of a section into meetings.
+    Meetings with malformed times are skipped, so that one bad row cannot keep the rest of a
+    semester from loading.
+
+    :param schedule: A list of meetings, a single meeting, or nothing at all
+    :return: The parsed meetings
+    :rtype: tuple
+    """
+    meetings = []
+    for meeting in as_list(schedule):
+        if not meeting.get("START_TIME") or not meeting.get("END_TIME"):
+            continue
+        try:
+            start = parse_time(meeting["START_TIME"])
+            end = parse_time(meeting["END_TIME"])
+        except ValueError:
+            start = end = None
+        if start is None or not 0 <= start <= end <= MINUTES_PER_DAY:
+            log.warning("Skipping a meeting with invalid times: %s - %s",
+                        meeting["START_TIME"], meeting["END_TIME"])
+            continue
+        meetings.append(Meeting(sys.intern(meeting["MTG_DAYS"]), start, end))
+    return tuple(meetings)
+
+
+def normalize_section(section: dict) -> Section:
+    """Turns a raw section from the catalog into a Section.
+
+    :param dict section: The raw JSON of a single section
+    :return: The normalized section
+    :rtype: Section
+    """
+    meetings = normalize_meetings(section.get("Schedule"))
+    meeting_times = NO_MEETING_TIMES
+    if meetings:
+        meeting_times = "\n".join(
+            f"{meeting.days}: {format_time(meeting.start)} - {format_time(meeting.end)}"
+            for meeting in meetings)
+    return Section(sys.intern(section["SECTION"]),
+                   sys.intern(section["INSTRUCTOR"]),
+                   _to_int(section["ENROLLED"]),
+                   _to_int(section["CAPACITY"]),
+                   sys.intern(section["INSTRUCTIONMETHOD"]),
+                   sys.intern(section["TITLE"]),
+                   meetings,
+                   sys.intern(meeting_times))
+
+
+def build_course_index(data: dict) -> dict:
+    """Creates a lookup table of every course in a semester's catalog.
+
+    :param dict data: The parsed JSON of a semester's catalog
+    :return: Course codes (e.g. "CS100") mapped to a tuple of their sections
+    :rtype: dict
+    """
+    courses = {}
+    for subject in as_list(data["ws"]["WSRESPONSE"]["Subject"]):
+        for course in as_list(subject.get("Course")):
+            section = course.get("Section")
+            if not isinstance(section, (list, dict)):
+                log.error("An unknown data structure was parsed for %s - %s",
+                          course["COURSE"], section)
+                continue
+            code = sys.intern(course["COURSE"])
+            courses[code] = courses.get(code, ()) + tuple(normalize_section(raw_section)
+                                                         for raw_section in as_list(section))
+    return courses
+
+
+def parse_semester_codes(data: dict) -> dict:
+    """Retrieves the semester code table from a semester's catalog.
+
+    :param dict data: The parsed JSON of a semester's catalog
+    :return: Semester codes mapped to their lowercase description (e.g. "fall 2020")
+    :rtype: dict
+    """
+    return {semester["EDIVALUE"]: semester["DESCRIPTION"].lower()
+            for semester in as_list(data["ts"]["WSRESPONSE"]["SOAXREF"])}
+
+
+def load_semester(payload: str) -> tuple:
+    """Parses a semester's catalog into everything the index needs.
+    This is meant to run in a worker process, so it only takes and returns picklable data.
+
+    :param str payload: The JSON of a semester's catalog
+    :return: The current semester code, the semester code table, and the course index
+    :rtype: tuple
+    """
+    data = json.loads(payload)
+    return str(data["ct"]), parse_semester_codes(data), build_course_index(data)
+
+
+class ScheduleIndex:
+    """An immutable snapshot of every loaded semester.
+    Updates create a new index so that readers never see a half-built one.
+    """
+    __slots__ = ("current_semester", "semester_codes", "semester_lookup", "courses", "versions")
+
+    def __init__(self, current_semester: str = None, semester_codes: dict = None,
+                 courses: dict = None, versions: dict = None):
+        self.current_semester = current_semester
+        self.semester_codes = semester_codes or {}
+        self.semester_lookup = {desc: code for code, desc in self.semester_codes.items()}
+        self.courses = courses or {}
+        self.versions = versions or {}  # Semester code -> identifier of the data it was built from
+
+    def __len__(self):
+        return len(self.courses)
+
+    def with_semester(self, semester_code: str, course_index, *, version: str = None,
+                      current_semester: str = None, semester_codes: dict = None):
+        """Creates a copy of the index with a semester added or replaced.
+
+        :param str semester_code: The semester that the course index belongs to
+        :param course_index: The course index of that semester (a dict or any other mapping)
+        :param str version: Identifies the data the course index was built from
+        :param str current_semester: Replaces the current semester if given
+        :param dict semester_codes: Replaces the semester code table if given
+        :return: The new index
+        :rtype: ScheduleIndex
+        """
+        courses = dict(self.courses)
+        courses[semester_code] = course_index
+        versions = dict(self.versions)
+        versions[semester_code] = version
+        return ScheduleIndex(current_semester or self.current_semester,
+                             semester_codes or self.semester_codes,
+                             courses,
+                             versions)
+
+    def retain_semesters(self, semester_codes):
+        """Creates a copy of the index that only contains the given semesters.
+
+        :param semester_codes: The semesters to keep
+        :return: The new index
+        :rtype: ScheduleIndex
+        """
+        return ScheduleIndex(self.current_semester, self.semester_codes,
+                             {code: courses for code, courses in self.courses.items()
+                              if code in semester_codes},
+                             {code: version for code, version in self.versions.items()
+                              if code in semester_codes})
+
+    def resolve_semester(self, description: str = None):
+        """Finds the semester code of a semester description (e.g. "Fall 2020").
+
+        :param str description: The semester to look up, or None for the current semester
+        :return: The semester code, or None if it does not exist
+        :rtype: str
+        """
+        if description is None:
+            return self.current_semester
+        return self.semester_lookup.get(description.lower())
+
+    def get_sections(self, semester_code: str, course_code: str) -> tuple:
+        """Retrieves all of the sections of a course in a semester.
+
+        :param str semester_code: The semester to retrieve the sections from
+        :param str course_code: The course to look for (e.g. "CS100")
+        :return: All of the matching sections, or an empty tuple if there are none
+        :rtype: tuple
+        """
+        return self.courses.get(semester_code, {}).get(course_code, ())
+
+
+def seat_counts(index: ScheduleIndex, keys) -> dict:
+    """Retrieves the seat counts of specific sections. Each course is only decoded once.
+
+    :param ScheduleIndex index: The index to read from
+    :param keys: (semester code, course code, section) tuples
+    :return: Each key that still exists mapped to its (enrolled, capacity)
+    :rtype: dict
+    """
+    counts = {}
+    courses = {}
+    for key in keys:
+        semester_code, course_code, section_number = key
+        if (semester_code, course_code) not in courses:
+            courses[semester_code, course_code] = {
+                section.section: (section.enrolled, section.capacity)
+                for section in index.get_sections(semester_code, course_code)}
+        if section_number in courses[semester_code, course_code]:
+            counts[key] = courses[semester_code, course_code][section_number]
+    return counts
+
+
+def memory_footprint(obj) -> int:
+    """Estimates the memory used by an object and everything it references.
+    Objects shared between containers (e.g. interned strings) are only counted once.
+
+    :param obj: The object to measure
+    :return: The size in bytes
+    :rtype: int
+    """
+    seen = set()
+    pending = [obj]
+    total = 0
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            pending.extend(current.keys())
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            pending.extend(current)
+        elif hasattr(current, "__slots__"):
+            pending.extend(getattr(current, slot) for slot in current.__slots__
+                           if hasattr(current, slot))
+    return total
@@ -0,0 +1,193 @@
+"""This module reads and writes the clowns table for the Clown cog.
+Every query is parameterized and awaited directly on the bot's connection pool, so results
+belong to the caller and concurrent nominations in different servers never share state.
+asyncpg prepares and caches each query on the connection the first time it runs.
+Every change is announced with NOTIFY so that other Pingu processes can update their caches.
+"""
+import logging
+
+
+# Channel that clown changes are announced on, with "<guild ID>:<clown's user ID>" as the payload
+CHANNEL = "clown_changes"
+VOTE_YES = "\N{white heavy check mark}"
+VOTE_NO = "\N{cross mark}"
+
+
+def to_user_id(result):
+    """Converts the numeric clown_id of a row into a Discord user ID."""
+    return int(result["clown_id"]) if result["clown_id"] is not None else None
+
+
+class Poll:
+    """An open clown of the week nomination and the votes counted for it so far.
+    The bot's own reactions are not counted.
+    """
+    __slots__ = ("message_id", "guild_id", "channel_id", "nominee_id", "ends_at", "votes",
+                 "cleared")
+
+    def __init__(self, message_id: int, guild_id: int, channel_id: int, nominee_id: int,
+                 ends_at):
+        self.message_id = message_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.nominee_id = nominee_id
+        self.ends_at = ends_at
+        self.votes = {VOTE_YES: 0, VOTE_NO: 0}
+        self.cleared = False  # Set when a moderator removes the votes
+
+    def passed(self) -> bool:
+        """Whether more people voted for the nomination than against it."""
+        return self.votes[VOTE_YES] > self.votes[VOTE_NO]
+
+
+class ClownStore:
+    """Data access for the clown of every server."""
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def all_clowns(self) -> dict:
+        """Retrieves the clown of every server.
+
+        :return: Guild IDs mapped to the clown's user ID
+        :rtype: dict
+        """
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch("SELECT guild_id, clown_id FROM clowns;")
+        return {int(result["guild_id"]): to_user_id(result) for result in results}
+
+    async def get_clown(self, guild_id: int):
+        """Retrieves the clown of a server and when they were clowned on.
+
+        :return: The row with clown_id and clowned_on, or None if the server never had a clown
+        :rtype: asyncpg.Record
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(
+                "SELECT clown_id, clowned_on FROM clowns WHERE guild_id = $1;", guild_id)
+
+    async def set_clown(self, guild_id: int, clown_id: int) -> None:
+        """Makes someone the clown of a server starting today and announces the change."""
+        async with self.pool.acquire() as conn:
+            # Notifications are only delivered once the transaction commits
+            async with conn.transaction():
+                await conn.execute(
+                    "INSERT INTO clowns (guild_id, clown_id, clowned_on) VALUES ($1, $2, NOW()) "
+                    "ON CONFLICT (guild_id) DO UPDATE "
+                    "SET clown_id = EXCLUDED.clown_id, clowned_on = EXCLUDED.clowned_on;",
+                    guild_id, clown_id)
+                await conn.execute("SELECT pg_notify($1, $2);", CHANNEL, f"{guild_id}:{clown_id}")
+
+    async def create_poll(self, poll: Poll) -> bool:
+        """Saves a poll so that it survives restarts.
+
+        :return: False if the server already has an open poll
+        :rtype: bool
+        """
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                "INSERT INTO clown_polls (message_id, guild_id, channel_id, nominee_id, ends_at) "
+                "VALUES ($1, $2, $3, $4, $5) ON CONFLICT DO NOTHING;",
+                poll.message_id, poll.guild_id, poll.channel_id, poll.nominee_id, poll.ends_at)
+        return status == "INSERT 0 1"
+
+    async def delete_poll(self, message_id: int) -> None:
+        """Removes a poll once it has been resolved."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM clown_polls WHERE message_id = $1;", message_id)
+
+    async def open_polls(self) -> list:
+        """Retrieves every poll that has not been resolved, with no votes counted."""
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch("SELECT message_id, guild_id, channel_id, nominee_id, "
+                                       "ends_at FROM clown_polls;")
+        return [Poll(int(result["message_id"]), int(result["guild_id"]),
+                     int(result["channel_id"]), int(result["nominee_id"]), result["ends_at"])
+                for result in results]
+
+
+class ClownCache:
+    """The clown of every server kept in memory in front of a ClownStore.
+    Changes are written to the database first and then to the cache entry of that server only,
+    and servers missing from the cache are loaded one at a time when they are first needed.
+    Changes made by other processes arrive through LISTEN on a connection kept for that purpose.
+    """
+    def __init__(self, store: ClownStore):
+        self.store = store
+        self.clowns = {}  # Guild ID -> clown's user ID, or None if the server has no clown
+        self.hits = 0
+        self.misses = 0
+        self.listener = None
+        self.loaded = False  # Whether every server was loaded since listening started
+        self.log = logging.getLogger(__name__)
+
+    @property
+    def listening(self) -> bool:
+        """Whether changes from other processes are currently being received."""
+        return self.listener is not None and not self.listener.is_closed()
+
+    async def listen(self) -> None:
+        """Starts receiving changes on a dedicated connection from the pool.
+        Changes made while nothing was listening are unknown, so the cache is emptied.
+        """
+        await self.close()
+        conn = await self.store.pool.acquire()
+        try:
+            await conn.add_listener(CHANNEL, self.on_change)
+        except Exception:
+            await self.store.pool.release(conn)
+            raise
+        conn.add_termination_listener(self.on_disconnect)
+        self.listener = conn
+        self.clowns.clear()
+        self.loaded = False
+
+    async def close(self) -> None:
+        """Stops receiving changes and returns the connection to the pool."""
+        conn, self.listener = self.listener, None
+        if conn is None:
+            return
+        if not conn.is_closed():
+            await conn.remove_listener(CHANNEL, self.on_change)
+        await self.store.pool.release(conn)
+
+    def on_change(self, connection, pid: int, channel: str, payload: str) -> None:
+        """Applies a change announced by any process, including this one."""
+        guild_id, clown_id = payload.split(":")
+        self.clowns[int(guild_id)] = int(clown_id)
+
+    def on_disconnect(self, connection) -> None:
+        """Notes that changes from other processes can no longer be received."""
+        self.log.warning("Lost the connection listening for clown changes")
+
+    async def load(self) -> None:
+        """Loads every server at once, which is only meant to be done on startup."""
+        clowns = await self.store.all_clowns()
+        for guild_id, clown_id in clowns.items():
+            self.clowns.setdefault(guild_id, clown_id)
+        self.loaded = True
+
+    async def get(self, guild_id: int):
+        """Retrieves the user ID of a server's clown, or None if there is no clown."""
+        if guild_id in self.clowns:
+            self.hits += 1
+            return self.clowns[guild_id]
+        self.misses += 1
+        result = await self.store.get_clown(guild_id)
+        clown_id = to_user_id(result) if result else None
+        # A change made while the query was running is newer, so it must not be overwritten
+        return self.clowns.setdefault(guild_id, clown_id)
+
+    def is_clown(self, guild_id: int, user_id: int) -> bool:
+        """Checks if someone is a server's clown using only what is already cached.
+        Once the cache is loaded, servers missing from it have no clown.
+        """
+        return self.clowns.get(guild_id) == user_id
+
+    async def set(self, guild_id: int, clown_id: int) -> None:
+        """Makes someone the clown of a server in the database and then in the cache."""
+        await self.store.set_clown(guild_id, clown_id)
+        self.clowns[guild_id] = clown_id
+
+    def invalidate(self, guild_id: int) -> None:
+        """Forgets a server so that it is loaded again the next time it is needed."""
+        self.clowns.pop(guild_id, None)
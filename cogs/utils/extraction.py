@@ -0,0 +1,132 @@
+"""This module caches youtube_dl extractions so that a track is looked up once, no matter how
+many servers request it. Entries last until their stream URL is about to expire, requests for a
+track that is already being looked up wait for that lookup, and lookups run on their own thread
+pool so they never hold up anything else that uses the default executor.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from cogs.utils.music_queue import EXPIRY_MARGIN, stream_expiry
+
+
+YOUTUBE_ID_PATTERN = re.compile(r"^[\w-]{11}$")
+
+
+def normalize_query(query: str) -> str:
+    """Turns a URL or search into a cache key, so that different ways of writing the same
+    request share one entry (e.g. youtu.be links and youtube.com links to the same video).
+    """
+    query = " ".join(query.split())
+    parts = urlsplit(query)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return f"search:{query.casefold()}"
+    host = parts.netloc.lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    video_id = None
+    if host == "youtu.be":
+        video_id = parts.path.strip("/")
+    elif host in ("youtube.com", "music.youtube.com"):
+        video_id = parse_qs(parts.query).get("v", [None])[0]
+    if video_id and YOUTUBE_ID_PATTERN.match(video_id):
+        return f"youtube:{video_id}"
+    return f"url:{host}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+class ExtractionCache:
+    """Least recently used extraction results, each kept until its stream URL expires."""
+    def __init__(self, extract, max_workers: int = 2, maxsize: int = 256):
+        """
+        :param extract: Blocking function that extracts the information of a URL or search
+        :param int max_workers: How many extractions can run at once
+        :param int maxsize: How many extractions to keep
+        """
+        self.extract = extract
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="extraction")
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # Key -> (expiry time, extracted information)
+        self.in_flight = {}  # Key -> extraction that is queued or running
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # Requests that waited for an extraction someone else started
+        self.queued = 0
+        self.running = 0
+        self.counter_lock = threading.Lock()  # The pool's threads update the counters as well
+
+    def run(self, query: str) -> dict:
+        """Extracts a track in the thread pool and keeps count of what is waiting."""
+        with self.counter_lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            data = self.extract(query)
+        finally:
+            with self.counter_lock:
+                self.running -= 1
+        if "entries" in data:
+            # Take first item from a playlist
+            data = data["entries"][0]
+        return data
+
+    async def get(self, query: str) -> dict:
+        """Retrieves the information of a URL or search, extracting it only if necessary.
+
+        :param str query: A URL or something to search for
+        :return: The extracted information of the track
+        :rtype: dict
+        :raises youtube_dl.DownloadError: If the extraction failed, which is not cached
+        """
+        key = normalize_query(query)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] - EXPIRY_MARGIN > time.time():
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+        extraction = self.in_flight.get(key)
+        if extraction is not None:
+            self.shared += 1
+        else:
+            self.misses += 1
+            with self.counter_lock:
+                self.queued += 1
+            extraction = asyncio.get_event_loop().run_in_executor(self.executor, self.run, query)
+            self.in_flight[key] = extraction
+            extraction.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            extraction.add_done_callback(lambda future: self.store(key, future))
+        # A request that is cancelled must not cancel the extraction for everyone else
+        return await asyncio.shield(extraction)
+
+    def store(self, key: str, extraction: asyncio.Future) -> None:
+        """Caches a finished extraction under its request and its video's page."""
+        if extraction.cancelled() or extraction.exception() is not None:
+            return
+        data = extraction.result()
+        expires_at = stream_expiry(data["url"])
+        keys = {key}
+        if data.get("webpage_url"):
+            keys.add(normalize_query(data["webpage_url"]))
+        for cache_key in keys:
+            self.entries[cache_key] = (expires_at, data)
+            self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Summarizes how requests were answered and how busy the thread pool is."""
+        return {"cached": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "queued": self.queued,
+                "running": self.running}
+
+    def shutdown(self) -> None:
+        """Stops the thread pool without waiting for extractions that are running."""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,81 @@
+"""This module keeps cache files in sync with the endpoints they were downloaded from.
+Each request sends the validators of the previous response, so an unchanged file costs a 304.
+A new response is written to a temporary file first, so the cache file is never left half written.
+"""
+import logging
+import os
+import tempfile
+from email.utils import formatdate
+
+import aiofiles
+import aiohttp
+
+
+class CacheFileFetcher:
+    """Revalidates cache files over one shared HTTP session."""
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.validators = {}  # Endpoint -> HTTP headers used to revalidate the cached response
+        self.log = logging.getLogger(__name__)
+
+    def has_validators(self, endpoint: str) -> bool:
+        """Whether the endpoint sent validators, which makes revalidating it cheap."""
+        return bool(self.validators.get(endpoint))
+
+    async def fetch(self, filename: str, endpoint: str, *, conditional: bool = True):
+        """Revalidates the requested cache file against the endpoint.
+        A new response is written to the cache file and returned.
+
+        :param str filename: Location of the cache file
+        :param str endpoint: URL to request the cache from
+        :param bool conditional: Whether an unchanged file may be answered with a 304, which
+            must not be allowed when the file on disk could not be loaded
+        :return: The new payload, or None if it is unchanged or could not be retrieved
+        :rtype: str
+        """
+        headers = {}
+        validators = self.validators.get(endpoint, {}) if conditional else {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+        elif conditional and os.path.exists(filename):
+            headers["If-Modified-Since"] = formatdate(os.path.getmtime(filename), usegmt=True)
+
+        try:
+            async with self.session.get(endpoint, headers=headers) as response:
+                if response.status == 304:
+                    self.log.info("Cache file '%s' is unchanged on the server", filename)
+                    return None
+                if response.status != 200:
+                    self.log.error(
+                        "Could not retrieve data for '%s'; endpoint responded with HTTP %s",
+                        filename,
+                        response.status)
+                    return None
+                self.validators[endpoint] = {header: response.headers[header]
+                                             for header in ("ETag", "Last-Modified")
+                                             if header in response.headers}
+                data = await response.text()
+                data = data[7:-1]  # Trim off "define( ... )" that surrounds the JSON
+                await self.write(filename, data)
+        except Exception as exc: # pylint: disable=broad-except
+            self.log.error("Could not update cache file: %s: %s", type(exc).__name__, exc)
+            return None
+        self.log.info("Cache file '%s' updated with latest data", filename)
+        return data
+
+    @staticmethod
+    async def write(filename: str, data: str) -> None:
+        """Replaces the cache file with a temporary file holding the new payload."""
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                                 prefix=os.path.basename(filename),
+                                                 suffix=".tmp")
+        os.close(descriptor)
+        try:
+            async with aiofiles.open(temporary, "w") as cache_file:
+                await cache_file.write(data)
+            os.replace(temporary, filename)
+        except BaseException:
+            os.remove(temporary)
+            raise
@@ -0,0 +1,116 @@
+"""This module keeps the music queue of every server.
+The next few tracks are resolved in the background while the current one plays, so the next
+track can start as soon as the current one ends. Stream URLs expire, so a track whose URL is
+about to expire is resolved again right before it plays.
+"""
+import asyncio
+import re
+import time
+
+
+LOOKAHEAD = 2  # How many upcoming tracks are resolved ahead of time
+DEFAULT_STREAM_TTL = 1800  # Seconds a stream URL is trusted for if it does not say when it expires
+EXPIRY_MARGIN = 60  # Seconds before expiring that a stream URL is no longer used
+EXPIRE_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+
+
+def stream_expiry(url: str, now: float = None) -> float:
+    """Finds when a stream URL expires, which YouTube stores in its expire parameter.
+
+    :param str url: The stream URL
+    :param float now: The current Unix time
+    :return: The Unix time the URL expires at
+    :rtype: float
+    """
+    match = EXPIRE_PATTERN.search(url)
+    if match:
+        return float(match.group(1))
+    return (now or time.time()) + DEFAULT_STREAM_TTL
+
+
+class Track:
+    """Something that was requested, and where to stream it from once it is resolved."""
+    __slots__ = ("query", "requester", "title", "webpage_url", "stream_url", "expires_at",
+                 "codec", "cache_key", "task")
+
+    def __init__(self, query: str, requester):
+        self.query = query
+        self.requester = requester
+        self.title = query
+        self.webpage_url = None
+        self.stream_url = None
+        self.expires_at = 0.0
+        self.codec = None  # Audio codec of the stream, if the extractor reported it
+        self.cache_key = None  # Where the track is or will be stored in the audio cache
+        self.task = None  # Background resolution, if one was started
+
+    def needs_resolving(self, now: float = None) -> bool:
+        """Whether the track has no stream URL yet or it expires too soon to be played."""
+        return (self.stream_url is None or
+                self.expires_at - EXPIRY_MARGIN <= (now or time.time()))
+
+
+class GuildQueue:
+    """The current track and the upcoming tracks of a server."""
+    def __init__(self, resolver, channel=None, lookahead: int = LOOKAHEAD):
+        """
+        :param resolver: Coroutine function that fills in the stream URL of a track
+        :param channel: The text channel that playback is announced in
+        :param int lookahead: How many upcoming tracks to resolve ahead of time
+        """
+        self.resolver = resolver
+        self.channel = channel
+        self.lookahead = lookahead
+        self.current = None
+        self.upcoming = []
+
+    def add(self, track: Track) -> int:
+        """Adds a track to the end of the queue and returns its position, starting from 1."""
+        self.upcoming.append(track)
+        self.prefetch()
+        return len(self.upcoming)
+
+    def next(self):
+        """Moves on to the next track, or to no track if the queue is empty."""
+        self.current = self.upcoming.pop(0) if self.upcoming else None
+        self.prefetch()
+        return self.current
+
+    def move(self, source: int, destination: int) -> Track:
+        """Moves a track to another position in the queue, where positions start from 1.
+
+        :raises IndexError: If either position is not in the queue
+        """
+        if not (1 <= source <= len(self.upcoming) and 1 <= destination <= len(self.upcoming)):
+            raise IndexError("Queue position out of range")
+        track = self.upcoming.pop(source - 1)
+        self.upcoming.insert(destination - 1, track)
+        self.prefetch()
+        return track
+
+    def clear(self) -> None:
+        """Removes every upcoming track and stops resolving them."""
+        for track in self.upcoming:
+            if track.task is not None:
+                track.task.cancel()
+        self.upcoming = []
+
+    def prefetch(self) -> None:
+        """Starts resolving the upcoming tracks that are about to play."""
+        for track in self.upcoming[:self.lookahead]:
+            if track.task is None and track.needs_resolving():
+                track.task = asyncio.ensure_future(self.resolver(track))
+
+    async def ready(self, track: Track) -> None:
+        """Waits until a track can be played, resolving it again if its URL is about to expire.
+
+        :raises Exception: Whatever the resolver raises if the track cannot be resolved
+        """
+        task, track.task = track.task, None
+        if task is not None:
+            try:
+                await task
+            except Exception:  # pylint: disable=broad-except
+                pass  # Resolving it in the background failed, so it is tried once more below
+        if track.needs_resolving():
+            await self.resolver(track)
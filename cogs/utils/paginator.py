@@ -0,0 +1,89 @@
+"""This module splits tables into pages that fit in a Discord message, and caches the result."""
+from collections import OrderedDict
+
+from prettytable import PrettyTable
+
+
+MESSAGE_LIMIT = 2000
+
+
+def paginate_rows(header: str, rows: list, limit: int = MESSAGE_LIMIT) -> list:
+    """Greedily packs rows into as few code block messages as possible.
+    The header is only placed at the top of the first page, and rows are never split.
+
+    :param str header: The column header line of the table
+    :param list rows: The rendered rows, which may span more than one line each
+    :param int limit: The maximum length of a single message
+    :return: The messages to send
+    :rtype: list
+    """
+    wrapper_size = len("``````")
+    pages = []
+    current = [header] if header else []
+    current_size = len(header)
+    for row in rows:
+        row_size = len(row) + (1 if current else 0)
+        if current and current_size + row_size + wrapper_size > limit:
+            pages.append(current)
+            current, current_size, row_size = [], 0, len(row)
+        current.append(row)
+        current_size += row_size
+    if current:
+        pages.append(current)
+    # A row that is too long by itself is truncated instead of breaking the message
+    return ["```{}```".format("\n".join(page)[:limit - wrapper_size]) for page in pages]
+
+
+def paginate_table(table: PrettyTable, limit: int = MESSAGE_LIMIT) -> list:
+    """Renders a table once and splits it into pages.
+    Cells must already be wrapped to their column width, so that every row is exactly as
+    tall as its tallest cell.
+
+    :param PrettyTable table: The table to render with its header on the first line
+    :param int limit: The maximum length of a single message
+    :return: The messages to send
+    :rtype: list
+    """
+    lines = table.get_string().split("\n")
+    header, lines = lines[0], lines[1:]
+    rows = []
+    for row in table.rows:
+        height = max(str(cell).count("\n") for cell in row) + 1
+        rows.append("\n".join(lines[:height]))
+        lines = lines[height:]
+    return paginate_rows(header, rows, limit)
+
+
+class RenderCache:
+    """A least recently used cache of rendered output.
+    Keys are tuples that start with the semester code so they can be invalidated together.
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        """Retrieves a cached value and marks it as recently used, or None if it is missing."""
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: tuple, value) -> None:
+        """Stores a value and evicts the least recently used one if the cache is full."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, semester_code: str = None) -> None:
+        """Removes everything rendered from a semester, or everything if none is given."""
+        if semester_code is None:
+            self.entries.clear()
+            return
+        for key in [key for key in self.entries if key[0] == semester_code]:
+            del self.entries[key]
@@ -0,0 +1,310 @@
+"""This module stores normalized schedule data in PostgreSQL so that every Pingu process
+can share one copy of the catalog. Only the process holding an advisory lock downloads the
+catalog, and it swaps each semester in with a single COPY inside a transaction, so everything
+else keeps answering indexed queries from the previous data until the new data commits.
+"""
+import csv
+from contextlib import asynccontextmanager
+
+from cogs.utils import catalog, search
+
+
+# Arbitrary keys for the advisory locks held by the process that is refreshing the catalog
+# and by the process that notifies watchers
+REFRESH_LOCK = 0x5049_4E47
+NOTIFY_LOCK = 0x5049_4E48
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule_semesters (
+    semester text PRIMARY KEY,
+    description text NOT NULL,
+    version text,
+    is_current boolean NOT NULL DEFAULT false
+);
+CREATE TABLE IF NOT EXISTS schedule_sections (
+    semester text NOT NULL,
+    course text NOT NULL,
+    position integer NOT NULL,
+    section text NOT NULL,
+    instructor text NOT NULL,
+    instructor_tokens text[] NOT NULL,
+    enrolled integer NOT NULL,
+    capacity integer NOT NULL,
+    method text NOT NULL,
+    title text NOT NULL,
+    title_tokens text[] NOT NULL,
+    meeting_times text NOT NULL,
+    meeting_days text[] NOT NULL,
+    meeting_starts integer[] NOT NULL,
+    meeting_ends integer[] NOT NULL,
+    PRIMARY KEY (semester, course, position)
+);
+CREATE INDEX IF NOT EXISTS schedule_sections_course_prefix
+    ON schedule_sections (semester, course text_pattern_ops);
+CREATE INDEX IF NOT EXISTS schedule_sections_instructor_tokens
+    ON schedule_sections USING gin (instructor_tokens);
+CREATE INDEX IF NOT EXISTS schedule_sections_title_tokens
+    ON schedule_sections USING gin (title_tokens);
+"""
+SECTION_COLUMNS = ("semester", "course", "position", "section", "instructor", "instructor_tokens",
+                   "enrolled", "capacity", "method", "title", "title_tokens", "meeting_times",
+                   "meeting_days", "meeting_starts", "meeting_ends")
+SELECT_SECTION = ("section, instructor, enrolled, capacity, method, title, meeting_days, "
+                  "meeting_starts, meeting_ends, meeting_times")
+
+
+def array_literal(values) -> str:
+    """Formats values as a PostgreSQL array literal, quoting every element."""
+    elements = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'"{element}"' for element in elements) + "}"
+
+
+def write_sections(filename: str, semester_code: str, course_index) -> int:
+    """Writes a semester's sections as CSV rows of SECTION_COLUMNS for COPY to read.
+    This is meant to run in a worker process, since it decodes every section of the semester
+    and a file is far cheaper to hand back than tens of thousands of records.
+
+    :param str filename: Where to write the rows
+    :param str semester_code: The semester the course index belongs to
+    :param course_index: Course codes mapped to their sections
+    :return: How many rows were written
+    :rtype: int
+    """
+    count = 0
+    with open(filename, "w", newline="") as csv_file:
+        # Quoting everything keeps empty strings from being read as NULL
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        for code, sections in course_index.items():
+            for position, section in enumerate(sections):
+                writer.writerow((
+                    semester_code, code, position, section.section, section.instructor,
+                    array_literal(search.normalize_name(section.instructor).split()),
+                    section.enrolled, section.capacity, section.method, section.title,
+                    array_literal(sorted(set(search.tokenize(section.title)))),
+                    section.meeting_times,
+                    array_literal(meeting.days for meeting in section.meetings),
+                    array_literal(meeting.start for meeting in section.meetings),
+                    array_literal(meeting.end for meeting in section.meetings)))
+                count += 1
+    return count
+
+
+def to_section(row) -> catalog.Section:
+    """Converts a row selected with SELECT_SECTION into a Section."""
+    meetings = tuple(catalog.Meeting(days, start, end) for days, start, end
+                     in zip(row["meeting_days"], row["meeting_starts"], row["meeting_ends"]))
+    return catalog.Section(row["section"], row["instructor"], row["enrolled"], row["capacity"],
+                           row["method"], row["title"], meetings, row["meeting_times"])
+
+
+class PostgresScheduleStore:
+    """Reads and writes schedule data through the bot's connection pool."""
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def create_tables(self) -> None:
+        """Creates the schedule tables and their indexes if they do not exist yet."""
+        async with self.pool.acquire() as conn:
+            await conn.execute(SCHEMA)
+
+    @asynccontextmanager
+    async def refresh_lock(self):
+        """Holds the advisory lock of the refreshing process for as long as the block runs.
+        The lock is only tried, so every other process is told right away that it is not the one
+        refreshing instead of waiting for it.
+
+        :return: Whether the lock was acquired
+        :rtype: bool
+        """
+        async with self.pool.acquire() as conn:
+            acquired = await conn.fetchval("SELECT pg_try_advisory_lock($1);", REFRESH_LOCK)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.execute("SELECT pg_advisory_unlock($1);", REFRESH_LOCK)
+
+    async def ingest(self, semester_code: str, version: str, filename: str, *,
+                     current_semester: str = None, semester_codes: dict = None) -> None:
+        """Replaces a semester's sections with a bulk COPY inside a single transaction,
+        so other processes keep reading the previous data until it commits.
+
+        :param str semester_code: The semester the rows belong to
+        :param str version: Identifies the data the rows were built from
+        :param str filename: CSV file written by write_sections
+        :param str current_semester: Marks the current semester if given
+        :param dict semester_codes: Replaces the semester code table if given
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if semester_codes:
+                    await conn.executemany(
+                        "INSERT INTO schedule_semesters (semester, description) VALUES ($1, $2) "
+                        "ON CONFLICT (semester) DO UPDATE SET description = EXCLUDED.description;",
+                        list(semester_codes.items()))
+                await conn.execute("DELETE FROM schedule_sections WHERE semester = $1;",
+                                   semester_code)
+                await conn.copy_to_table("schedule_sections", source=filename,
+                                         columns=SECTION_COLUMNS, format="csv")
+                await conn.execute("UPDATE schedule_semesters SET version = $2 "
+                                   "WHERE semester = $1;", semester_code, version)
+                if current_semester:
+                    await conn.execute("UPDATE schedule_semesters SET is_current = "
+                                       "(semester = $1);", current_semester)
+
+    async def retain_semesters(self, semester_codes) -> None:
+        """Deletes the sections of every semester that is not given."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM schedule_sections "
+                                   "WHERE NOT semester = ANY($1::text[]);", list(semester_codes))
+                await conn.execute("UPDATE schedule_semesters SET version = NULL "
+                                   "WHERE NOT semester = ANY($1::text[]);", list(semester_codes))
+
+    async def load_index(self) -> catalog.ScheduleIndex:
+        """Loads the semester code table and the versions of the stored semesters.
+        Sections stay in the database, so the course index of every semester is empty.
+        """
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                "SELECT semester, description, version, is_current FROM schedule_semesters;")
+        current_semester = next((result["semester"] for result in results
+                                 if result["is_current"]), None)
+        return catalog.ScheduleIndex(
+            current_semester,
+            {result["semester"]: result["description"].lower() for result in results},
+            {result["semester"]: {} for result in results if result["version"] is not None},
+            {result["semester"]: result["version"] for result in results
+             if result["version"] is not None})
+
+    async def get_sections(self, semester_code: str, course_code: str) -> tuple:
+        """Retrieves all of the sections of a course in a semester."""
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                f"SELECT {SELECT_SECTION} FROM schedule_sections "
+                "WHERE semester = $1 AND course = $2 ORDER BY position;",
+                semester_code, course_code)
+        return tuple(to_section(result) for result in results)
+
+    async def search_courses(self, semester_code: str, text: str, limit: int = 25) -> list:
+        """Finds courses by course code prefix, then by how many title words they share.
+
+        :return: (course code, title) pairs
+        :rtype: list
+        """
+        prefix = "".join(char for char in text.upper() if char.isalnum())
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                "SELECT course, min(title) AS title, 0 AS kind, 0 AS score "
+                "FROM schedule_sections WHERE semester = $1 AND course LIKE $2 GROUP BY course "
+                "UNION ALL "
+                "SELECT course, min(title), 1, -max(cardinality(ARRAY("
+                "SELECT unnest(title_tokens) INTERSECT SELECT unnest($3::text[])))) "
+                "FROM schedule_sections WHERE semester = $1 AND title_tokens && $3::text[] "
+                "GROUP BY course "
+                "ORDER BY kind, score, course LIMIT $4;",
+                semester_code, f"{prefix}%" if prefix else "", search.tokenize(text), limit)
+        matches = {}
+        for result in results:
+            matches.setdefault(result["course"], result["title"])
+        return list(matches.items())
+
+    async def instructor_sections(self, semester_code: str, name: str) -> list:
+        """Finds the sections taught by instructors whose names contain every word of a name.
+
+        :return: (course code, Section) pairs ordered by instructor
+        :rtype: list
+        """
+        tokens = search.tokenize(name)
+        if not tokens:
+            return []
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                f"SELECT course, {SELECT_SECTION} FROM schedule_sections "
+                "WHERE semester = $1 AND instructor_tokens @> $2::text[] "
+                "ORDER BY instructor, course, position;",
+                semester_code, tokens)
+        return [(result["course"], to_section(result)) for result in results]
+
+    async def seat_counts(self, keys) -> dict:
+        """Retrieves the seat counts of specific sections.
+
+        :param keys: (semester code, course code, section) tuples
+        :return: Each key that still exists mapped to its (enrolled, capacity)
+        :rtype: dict
+        """
+        keys = list(keys)
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                "SELECT semester, course, section, enrolled, capacity FROM schedule_sections "
+                "JOIN unnest($1::text[], $2::text[], $3::text[]) AS watched(semester, course, "
+                "section) USING (semester, course, section);",
+                [key[0] for key in keys], [key[1] for key in keys], [key[2] for key in keys])
+        return {(result["semester"], result["course"], result["section"]):
+                (result["enrolled"], result["capacity"]) for result in results}
+
+
+class SectionWatches:
+    """Reads and writes the section_watches table, which every Pingu process shares."""
+    def __init__(self, pool):
+        self.pool = pool
+        self.notifier = None  # Connection holding NOTIFY_LOCK while this process notifies
+
+    async def claim_notifier(self) -> bool:
+        """Makes this process the one that notifies watchers unless another process already is.
+        The lock stays held on a connection of its own, so the same process keeps notifying
+        until it releases the lock or loses that connection.
+
+        :return: Whether this process notifies watchers
+        :rtype: bool
+        """
+        if self.notifier is not None and not self.notifier.is_closed():
+            return True
+        if self.notifier is not None:
+            await self.release_notifier()
+        conn = await self.pool.acquire()
+        try:
+            acquired = await conn.fetchval("SELECT pg_try_advisory_lock($1);", NOTIFY_LOCK)
+        except Exception:
+            await self.pool.release(conn)
+            raise
+        if not acquired:
+            await self.pool.release(conn)
+            return False
+        self.notifier = conn
+        return True
+
+    async def release_notifier(self) -> None:
+        """Lets another process notify watchers. Released connections drop their locks."""
+        conn, self.notifier = self.notifier, None
+        if conn is not None:
+            await self.pool.release(conn)
+
+    async def load(self) -> dict:
+        """Retrieves every watched section.
+
+        :return: (semester code, course code, section) keys mapped to a set of user IDs
+        :rtype: dict
+        """
+        async with self.pool.acquire() as conn:
+            results = await conn.fetch(
+                "SELECT user_id, semester, course, section FROM section_watches;")
+        watches = {}
+        for result in results:
+            key = (result["semester"], result["course"], result["section"])
+            watches.setdefault(key, set()).add(int(result["user_id"]))
+        return watches
+
+    async def add(self, user_id: int, key: tuple) -> None:
+        """Watches a (semester code, course code, section) key for a user."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("INSERT INTO section_watches (user_id, semester, course, section) "
+                               "VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING;",
+                               user_id, *key)
+
+    async def remove(self, user_id: int, key: tuple) -> None:
+        """Stops watching a (semester code, course code, section) key for a user."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM section_watches "
+                               "WHERE user_id = $1 AND semester = $2 AND course = $3 "
+                               "AND section = $4;",
+                               user_id, *key)
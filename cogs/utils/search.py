@@ -0,0 +1,164 @@
+"""This module searches course codes and titles of a semester.
+Everything is indexed when the semester is loaded, so queries never scan the catalog.
+"""
+import heapq
+import re
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+CODE_PATTERN = re.compile(r"^[a-z]{1,4}\s*\d{0,3}[a-z]?$")
+
+
+def tokenize(text: str) -> list:
+    """Splits text into lowercase words."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def deletions(token: str) -> set:
+    """Returns every variation of a token with one character removed."""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def edit_distance(first: str, second: str) -> int:
+    """Returns the Levenshtein distance between two strings."""
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+
+class SearchIndex:
+    """Course codes in a prefix trie and course titles in an inverted index.
+    Misspelled title words are matched against words one edit away using a table of
+    single-character deletions, so typos are found without comparing every word.
+    """
+    __slots__ = ("titles", "trie", "postings", "typos")
+
+    def __init__(self, course_index):
+        self.titles = {}
+        self.trie = {}
+        self.postings = {}
+        self.typos = {}
+        for code, sections in course_index.items():
+            titles = [section.title for section in sections]
+            # Honors sections share the course code, so prefer the regular title
+            self.titles[code] = next((title for title in titles if "honors" not in title.lower()),
+                                     titles[0] if titles else "")
+            node = self.trie
+            for char in code.lower():
+                node = node.setdefault(char, {})
+            node[None] = code
+            for token in set(tokenize(" ".join(titles))):
+                self.postings.setdefault(token, set()).add(code)
+        for token in self.postings:
+            for variation in deletions(token) | {token}:
+                self.typos.setdefault(variation, set()).add(token)
+
+    def prefix(self, text: str, limit: int) -> list:
+        """Finds course codes that start with the text (e.g. "cs11" finds CS110 and CS113).
+
+        :param str text: The start of a course code
+        :param int limit: The maximum number of codes to return
+        :return: The matching course codes in order
+        :rtype: list
+        """
+        node = self.trie
+        for char in text.lower().replace(" ", ""):
+            node = node.get(char)
+            if node is None:
+                return []
+        matches = []
+        pending = [node]
+        while pending and len(matches) < limit:
+            node = pending.pop()
+            if None in node:
+                matches.append(node[None])
+            pending.extend(node[char] for char in sorted((key for key in node if key is not None),
+                                                         reverse=True))
+        return matches
+
+    def similar_tokens(self, token: str) -> set:
+        """Finds indexed words that are at most one edit away from a word."""
+        candidates = set()
+        for variation in deletions(token) | {token}:
+            candidates |= self.typos.get(variation, set())
+        return {candidate for candidate in candidates if edit_distance(token, candidate) <= 1}
+
+    def search(self, text: str, limit: int = 25) -> list:
+        """Finds the courses that best match the text.
+        Course code prefixes come first, followed by titles ranked by how many words they match.
+
+        :param str text: A partial course code or words from a course title
+        :param int limit: The maximum number of results
+        :return: (course code, title) pairs
+        :rtype: list
+        """
+        results = []
+        if CODE_PATTERN.match(text.lower().strip()):
+            results.extend(self.prefix(text, limit))
+
+        scores = {}
+        for token in tokenize(text):
+            if token in self.postings:
+                matches, weight = {token}, 2
+            else:
+                matches, weight = self.similar_tokens(token), 1
+            for match in matches:
+                for code in self.postings[match]:
+                    scores[code] = scores.get(code, 0) + weight
+        found = set(results)
+        ranked = heapq.nsmallest(limit, (code for code in scores if code not in found),
+                                 key=lambda code: (-scores[code], code))
+        return [(code, self.titles[code]) for code in (results + ranked)[:limit]]
+
+
+def normalize_name(name: str) -> str:
+    """Normalizes an instructor's name so that "Smith, John" and "john smith" are the same."""
+    return " ".join(sorted(tokenize(name)))
+
+
+class InstructorIndex:
+    """Instructors of a semester mapped to the sections they teach.
+    Sections are stored by position so that they are only decoded when they are displayed.
+    """
+    __slots__ = ("names", "sections", "postings")
+
+    def __init__(self, course_index):
+        self.names = {}  # Normalized name -> name as written in the catalog
+        # Normalized name -> ((course code, ...), (section position, ...)), which are kept as
+        # two flat tuples instead of a tuple per section so that the index is cheap to transfer
+        self.sections = {}
+        self.postings = {}  # Name token -> normalized names
+        for code, course_sections in course_index.items():
+            for position, section in enumerate(course_sections):
+                key = normalize_name(section.instructor)
+                if not key:
+                    continue  # Unassigned sections have an instructor of ", "
+                self.names.setdefault(key, section.instructor)
+                codes, positions = self.sections.setdefault(key, ([], []))
+                codes.append(code)
+                positions.append(position)
+                for token in key.split():
+                    self.postings.setdefault(token, set()).add(key)
+        self.sections = {key: (tuple(codes), tuple(positions))
+                         for key, (codes, positions) in self.sections.items()}
+
+    def search(self, name: str) -> list:
+        """Finds the instructors whose names contain every word of the given name.
+
+        :param str name: Any part of an instructor's name (e.g. "smith" or "John Smith")
+        :return: Normalized names in alphabetical order
+        :rtype: list
+        """
+        tokens = tokenize(name)
+        if not tokens:
+            return []
+        matches = set(self.postings.get(tokens[0], ()))
+        for token in tokens[1:]:
+            matches &= self.postings.get(token, set())
+        return sorted(matches)
@@ -0,0 +1,245 @@
+"""This module persists a semester's course index as a compact binary snapshot.
+Snapshots are memory mapped instead of read, so loading one only decodes its course directory,
+and every process on the host that maps the same file shares its pages.
+
+Layout (little-endian):
+    header      magic, format version, source payload hash, body checksum and table sizes
+    metadata    JSON with the current semester and the semester code table
+    strings     offset table followed by the UTF-8 data of every unique string
+    courses     (code, first section, section count) per course
+    sections    fixed-size section records that refer to the string table
+    meetings    (days, start, end) per meeting
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from collections.abc import Mapping
+
+from cogs.utils import catalog, search
+
+
+MAGIC = b"PINGUIDX"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sH32sIIIIII")
+OFFSET = struct.Struct("<I")
+COURSE = struct.Struct("<III")
+SECTION = struct.Struct("<IIIIIIIII")
+MEETING = struct.Struct("<IHH")
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is missing, corrupted, outdated or built from different data."""
+
+
+def snapshot_filename(cache_filename: str) -> str:
+    """Returns the location of the snapshot that belongs next to a JSON cache file."""
+    return f"{os.path.splitext(cache_filename)[0]}.snapshot"
+
+
+def write_snapshot(filename: str, source_hash: str, current_semester: str,
+                   semester_codes: dict, course_index: dict) -> None:
+    """Writes a course index to disk. The file is replaced atomically.
+
+    :param str filename: Location of the snapshot
+    :param str source_hash: SHA-256 hex digest of the JSON payload the index was built from
+    :param str current_semester: The current semester according to the payload
+    :param dict semester_codes: The semester code table of the payload
+    :param dict course_index: The output of catalog.build_course_index
+    """
+    strings = {}
+
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    courses, sections, meetings = bytearray(), bytearray(), bytearray()
+    section_count = meeting_count = 0
+    for code, course_sections in course_index.items():
+        courses += COURSE.pack(string_id(code), section_count, len(course_sections))
+        for section in course_sections:
+            sections += SECTION.pack(string_id(section.section),
+                                     string_id(section.instructor),
+                                     section.enrolled,
+                                     section.capacity,
+                                     string_id(section.method),
+                                     string_id(section.title),
+                                     string_id(section.meeting_times),
+                                     meeting_count,
+                                     len(section.meetings))
+            section_count += 1
+            for meeting in section.meetings:
+                meetings += MEETING.pack(string_id(meeting.days), meeting.start, meeting.end)
+                meeting_count += 1
+
+    encoded = [value.encode() for value in strings]
+    string_offsets = bytearray()
+    position = 0
+    for value in encoded:
+        string_offsets += OFFSET.pack(position)
+        position += len(value)
+    string_offsets += OFFSET.pack(position)
+    string_data = b"".join(encoded)
+    string_data += b"\0" * (-len(string_data) % 4)  # Keep the records after it aligned
+
+    metadata = json.dumps({"current_semester": current_semester,
+                           "semester_codes": semester_codes}).encode()
+    metadata += b" " * (-len(metadata) % 4)
+    body = b"".join((metadata, string_offsets, string_data, courses, sections, meetings))
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, bytes.fromhex(source_hash), zlib.crc32(body),
+                         len(strings), len(course_index), section_count, meeting_count,
+                         len(metadata))
+
+    # Every process on the host can rebuild the same snapshot, so each writes a file of its own
+    descriptor, temp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                                 prefix=os.path.basename(filename),
+                                                 suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as snapshot_file:
+            snapshot_file.write(header)
+            snapshot_file.write(body)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def build_snapshot(payload: str, filename: str, source_hash: str) -> None:
+    """Parses a semester's catalog and writes its snapshot.
+    This is meant to run in a worker process, which then only has to hand back the file name.
+
+    :param str payload: The JSON of a semester's catalog
+    :param str filename: Location of the snapshot
+    :param str source_hash: SHA-256 hex digest of the payload
+    """
+    current_semester, semester_codes, course_index = catalog.load_semester(payload)
+    write_snapshot(filename, source_hash, current_semester, semester_codes, course_index)
+
+
+def build_indexes(course_index) -> tuple:
+    """Builds every index that is derived from a semester's course index.
+
+    :param course_index: Course codes mapped to their sections
+    :return: The search.SearchIndex and search.InstructorIndex
+    :rtype: tuple
+    """
+    return search.SearchIndex(course_index), search.InstructorIndex(course_index)
+
+
+def derive_from_snapshot(filename: str, source_hash: str, derive):
+    """Maps a snapshot and builds something from its course index.
+    This is meant to run in a worker process, so that decoding every section of a semester
+    never blocks the event loop. Only the result is handed back.
+
+    :param str filename: Location of the snapshot
+    :param str source_hash: SHA-256 hex digest of the payload the snapshot must be built from
+    :param derive: Module level function that is given the course index
+    :return: Whatever derive returns
+    """
+    return derive(load_snapshot(filename, source_hash).courses)
+
+
+class MappedCourseIndex(Mapping):
+    """A read-only course index backed by a memory mapped snapshot.
+    Sections are decoded when they are looked up instead of when the snapshot is loaded.
+    """
+    def __init__(self, buffer: mmap.mmap, string_count: int, course_count: int,
+                 section_count: int, strings_start: int):
+        self.buffer = buffer
+        self.string_count = string_count
+        self.strings_start = strings_start
+        self.string_data_start = strings_start + (string_count + 1) * OFFSET.size
+        string_data_size = OFFSET.unpack_from(buffer,
+                                              strings_start + string_count * OFFSET.size)[0]
+        courses_start = self.string_data_start + string_data_size + (-string_data_size % 4)
+        self.sections_start = courses_start + course_count * COURSE.size
+        self.meetings_start = self.sections_start + section_count * SECTION.size
+        self.decoded_strings = {}
+
+        self.directory = {}
+        for position in range(courses_start, self.sections_start, COURSE.size):
+            code, first, count = COURSE.unpack_from(buffer, position)
+            self.directory[self.string(code)] = (first, count)
+
+    def string(self, string_id: int) -> str:
+        """Decodes a string from the string table. Every string is decoded at most once."""
+        value = self.decoded_strings.get(string_id)
+        if value is None:
+            start, end = struct.unpack_from("<II", self.buffer,
+                                            self.strings_start + string_id * OFFSET.size)
+            value = str(self.buffer[self.string_data_start + start:
+                                    self.string_data_start + end], "utf-8")
+            self.decoded_strings[string_id] = value
+        return value
+
+    def section(self, position: int) -> catalog.Section:
+        """Decodes a single section record."""
+        (section, instructor, enrolled, capacity, method, title, meeting_times,
+         first_meeting, meeting_count) = SECTION.unpack_from(
+             self.buffer, self.sections_start + position * SECTION.size)
+        meetings = []
+        for meeting in range(first_meeting, first_meeting + meeting_count):
+            days, start, end = MEETING.unpack_from(self.buffer,
+                                                   self.meetings_start + meeting * MEETING.size)
+            meetings.append(catalog.Meeting(self.string(days), start, end))
+        return catalog.Section(self.string(section), self.string(instructor), enrolled, capacity,
+                               self.string(method), self.string(title), tuple(meetings),
+                               self.string(meeting_times))
+
+    def __getitem__(self, course_code: str) -> tuple:
+        first, count = self.directory[course_code]
+        return tuple(self.section(position) for position in range(first, first + count))
+
+    def __iter__(self):
+        return iter(self.directory)
+
+    def __len__(self):
+        return len(self.directory)
+
+
+class Snapshot:
+    """A loaded snapshot and the metadata that was stored with it."""
+    __slots__ = ("source_hash", "current_semester", "semester_codes", "courses")
+
+    def __init__(self, source_hash: str, current_semester: str, semester_codes: dict,
+                 courses: MappedCourseIndex):
+        self.source_hash = source_hash
+        self.current_semester = current_semester
+        self.semester_codes = semester_codes
+        self.courses = courses
+
+
+def load_snapshot(filename: str, source_hash: str = None) -> Snapshot:
+    """Memory maps a snapshot after verifying it.
+
+    :param str filename: Location of the snapshot
+    :param str source_hash: If given, the snapshot must have been built from this payload
+    :return: The loaded snapshot
+    :rtype: Snapshot
+    :raises SnapshotError: If the snapshot cannot be used
+    """
+    try:
+        with open(filename, "rb") as snapshot_file:
+            buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as exc:
+        raise SnapshotError(f"Could not open snapshot '{filename}': {exc}") from exc
+
+    if len(buffer) < HEADER.size:
+        raise SnapshotError(f"Snapshot '{filename}' is truncated")
+    (magic, version, digest, checksum, string_count, course_count, section_count,
+     meeting_count, metadata_size) = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot '{filename}' has an unsupported format")
+    if source_hash is not None and digest.hex() != source_hash:
+        raise SnapshotError(f"Snapshot '{filename}' was built from different data")
+    if zlib.crc32(memoryview(buffer)[HEADER.size:]) != checksum:
+        raise SnapshotError(f"Snapshot '{filename}' failed its checksum")
+
+    metadata = json.loads(buffer[HEADER.size:HEADER.size + metadata_size])
+    courses = MappedCourseIndex(buffer, string_count, course_count, section_count,
+                                HEADER.size + metadata_size)
+    if courses.meetings_start + meeting_count * MEETING.size != len(buffer):
+        raise SnapshotError(f"Snapshot '{filename}' does not match its header")
+    return Snapshot(digest.hex(), metadata["current_semester"], metadata["semester_codes"],
+                    courses)
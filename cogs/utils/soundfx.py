@@ -0,0 +1,87 @@
+"""This module keeps sound effects in memory as Opus packets that are ready to be sent.
+Each file is encoded by ffmpeg once when it is loaded, so playing a sound effect afterwards
+needs no subprocess, no decoding and no encoding.
+"""
+import asyncio
+import io
+import logging
+import os
+
+import discord
+from discord.oggparse import OggStream
+
+
+# The same output that discord.FFmpegOpusAudio asks ffmpeg for
+FFMPEG_OPUS_OPTIONS = ("-map_metadata", "-1", "-f", "opus", "-c:a", "libopus", "-ar", "48000",
+                       "-ac", "2", "-b:a", "128k", "-loglevel", "warning")
+
+
+async def encode_opus(filename: str, executable: str = "ffmpeg") -> tuple:
+    """Encodes an audio file into 20 ms Opus packets without blocking the event loop.
+
+    :param str filename: The audio file to encode
+    :param str executable: The ffmpeg executable to run
+    :return: The Opus packets in order
+    :rtype: tuple
+    :raises OSError: If ffmpeg could not be run or failed to encode the file
+    """
+    process = await asyncio.create_subprocess_exec(
+        executable, "-i", filename, *FFMPEG_OPUS_OPTIONS, "pipe:1",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    output, errors = await process.communicate()
+    if process.returncode != 0:
+        raise OSError(f"ffmpeg failed to encode '{filename}': {errors.decode().strip()}")
+    # The identification and comment headers of the Ogg stream are not audio
+    return tuple(packet for packet in OggStream(io.BytesIO(output)).iter_packets()
+                 if not packet.startswith((b"OpusHead", b"OpusTags")))
+
+
+class CachedOpusAudio(discord.AudioSource):
+    """Plays Opus packets that are already in memory."""
+    def __init__(self, packets: tuple):
+        self.packets = packets
+        self.position = 0
+
+    def read(self) -> bytes:
+        if self.position >= len(self.packets):
+            return b""
+        packet = self.packets[self.position]
+        self.position += 1
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class SoundEffects:
+    """Every sound effect in a directory, encoded once and shared by every server."""
+    def __init__(self, directory: str = "soundfx", executable: str = "ffmpeg"):
+        self.directory = directory
+        self.executable = executable
+        self.sounds = {}  # File name without its extension -> Opus packets
+        self.log = logging.getLogger(__name__)
+
+    async def load(self) -> None:
+        """Encodes every file in the directory. Files that fail are logged and skipped."""
+        for entry in sorted(os.listdir(self.directory)):
+            name = os.path.splitext(entry)[0]
+            try:
+                self.sounds[name] = await encode_opus(os.path.join(self.directory, entry),
+                                                      self.executable)
+            except OSError as exc:
+                self.log.error("Unable to encode sound effect '%s': %s", entry, exc)
+                continue
+            self.log.info("Encoded sound effect '%s' into %d packets",
+                          name, len(self.sounds[name]))
+
+    def source(self, name: str):
+        """Creates an audio source for a sound effect.
+
+        :param str name: The file name of the sound effect without its extension
+        :return: The audio source, or None if the sound effect is not loaded
+        :rtype: CachedOpusAudio
+        """
+        packets = self.sounds.get(name)
+        return CachedOpusAudio(packets) if packets is not None else None
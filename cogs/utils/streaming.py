@@ -0,0 +1,142 @@
+"""This module opens the audio streams that music is played from.
+A stream that is already Opus is copied straight through to Discord, so it is never decoded or
+encoded again. Any other stream, or one whose volume has to change, is encoded to Opus by ffmpeg
+with the volume applied as a filter, so the audio thread never touches PCM. The CPU time of every
+stream is measured so that both ways of streaming can be compared.
+"""
+import threading
+import time
+from collections import deque
+
+import discord
+import psutil
+
+
+OPUS_CODECS = ("opus", "libopus")
+FRAME_SECONDS = 0.02  # Discord sends 20 ms of audio per frame
+PASSTHROUGH = "passthrough"
+TRANSCODE = "transcode"
+
+
+class MeasuredAudio(discord.AudioSource):
+    """An ffmpeg stream that keeps track of the CPU time spent on it.
+    That is the CPU time of its ffmpeg process plus that of the audio thread reading it, which
+    includes any Opus encoding and the sending of packets.
+    """
+    def __init__(self, original: discord.FFmpegAudio, mode: str, usage):
+        self.original = original
+        self.mode = mode
+        self.usage = usage
+        self.frames = 0
+        self.thread_start = None
+        self.thread_cpu = 0.0
+        self.ffmpeg_cpu = 0.0
+        try:
+            self.process = psutil.Process(original._process.pid)  # pylint: disable=protected-access
+        except psutil.Error:
+            self.process = None
+        usage.start(self)
+
+    def read(self) -> bytes:
+        # Each frame is read by the same audio thread, so its CPU time covers everything that
+        # thread did since the first frame
+        now = time.thread_time()
+        if self.thread_start is None:
+            self.thread_start = now
+        self.thread_cpu = now - self.thread_start
+        data = self.original.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        self.measure_ffmpeg()
+        self.original.cleanup()
+        self.usage.finish(self)
+
+    def measure_ffmpeg(self) -> float:
+        """Updates and returns the CPU seconds used by ffmpeg so far."""
+        if self.process is not None:
+            try:
+                times = self.process.cpu_times()
+                self.ffmpeg_cpu = times.user + times.system
+            except psutil.Error:
+                self.process = None  # It exited, so the last measurement is kept
+        return self.ffmpeg_cpu
+
+    @property
+    def seconds(self) -> float:
+        """How many seconds of audio were read."""
+        return self.frames * FRAME_SECONDS
+
+
+class StreamUsage:
+    """The CPU time used by streams that are playing and by recently finished ones."""
+    def __init__(self, history: int = 100):
+        self.playing = set()
+        self.finished = deque(maxlen=history)  # (mode, audio seconds, ffmpeg CPU, thread CPU)
+        self.lock = threading.Lock()  # Streams finish in their audio threads
+
+    def start(self, source: MeasuredAudio) -> None:
+        with self.lock:
+            self.playing.add(source)
+
+    def finish(self, source: MeasuredAudio) -> None:
+        with self.lock:
+            if source in self.playing:
+                self.playing.remove(source)
+                self.finished.append((source.mode, source.seconds, source.ffmpeg_cpu,
+                                      source.thread_cpu))
+
+    def stats(self) -> dict:
+        """Summarizes the CPU time of each way of streaming.
+
+        :return: Mode -> streams playing, streams measured, and the CPU milliseconds that
+            ffmpeg and the bot used per minute of audio
+        :rtype: dict
+        """
+        with self.lock:
+            playing = list(self.playing)
+            samples = list(self.finished)
+        samples.extend((source.mode, source.seconds, source.measure_ffmpeg(), source.thread_cpu)
+                       for source in playing)
+        summary = {}
+        for mode in (PASSTHROUGH, TRANSCODE):
+            measured = [sample for sample in samples if sample[0] == mode]
+            minutes = sum(seconds for _, seconds, _, _ in measured) / 60
+            summary[mode] = {
+                "playing": sum(1 for source in playing if source.mode == mode),
+                "streams": len(measured),
+                "ffmpeg_ms_per_min": (sum(cpu for _, _, cpu, _ in measured) * 1000 / minutes
+                                      if minutes else None),
+                "bot_ms_per_min": (sum(cpu for _, _, _, cpu in measured) * 1000 / minutes
+                                   if minutes else None)}
+        return summary
+
+
+async def open_stream(url: str, usage: StreamUsage, *, codec: str = None, volume: float = 1.0,
+                      executable: str = "ffmpeg", before_options: str = None,
+                      options: str = None) -> MeasuredAudio:
+    """Opens a stream as Opus, copying it through when it is Opus already.
+
+    :param str url: Where to stream from
+    :param StreamUsage usage: Where the CPU time of the stream is recorded
+    :param str codec: The audio codec of the stream, which is probed for if it is unknown
+    :param float volume: The volume to play at, where anything but 1.0 needs encoding
+    :return: The stream
+    :rtype: MeasuredAudio
+    """
+    if codec is None:
+        codec, _ = await discord.FFmpegOpusAudio.probe(url, executable=executable)
+    if codec in OPUS_CODECS and volume == 1.0:
+        mode = PASSTHROUGH
+    else:
+        mode, codec = TRANSCODE, None
+        if volume != 1.0:
+            options = f"{options or ''} -filter:a volume={volume}".strip()
+    source = discord.FFmpegOpusAudio(url, codec=codec, executable=executable,
+                                     before_options=before_options, options=options)
+    return MeasuredAudio(source, mode, usage)
@@ -0,0 +1,132 @@
+"""This module finds combinations of sections whose meeting times do not conflict.
+A section's week is stored as a bitmask with one bit per minute, so two sections conflict
+exactly when their masks share a bit.
+"""
+import heapq
+import time
+
+
+DAYS = "MTWRFSU"
+MINUTES_PER_DAY = 24 * 60
+DAY_MASK = (1 << MINUTES_PER_DAY) - 1
+
+
+def weekly_mask(meetings) -> int:
+    """Converts meetings into a bitmask of the minutes they occupy during the week.
+
+    :param meetings: catalog.Meeting tuples
+    :return: The bitmask, which is 0 for sections without meeting times
+    :rtype: int
+    """
+    mask = 0
+    for meeting in meetings:
+        minutes = ((1 << (meeting.end - meeting.start)) - 1) << meeting.start
+        for day in meeting.days:
+            if day in DAYS:
+                mask |= minutes << (DAYS.index(day) * MINUTES_PER_DAY)
+    return mask
+
+
+def build_timetable_index(course_index) -> dict:
+    """Groups the sections of every course by their weekly meeting times.
+    Sections that meet at the same times are interchangeable, so they share one entry.
+
+    :param course_index: Course codes mapped to their sections
+    :return: Course codes mapped to (mask, section numbers) tuples
+    :rtype: dict
+    """
+    timetable = {}
+    for code, sections in course_index.items():
+        groups = {}
+        for section in sections:
+            groups.setdefault(weekly_mask(section.meetings), []).append(section.section)
+        timetable[code] = tuple((mask, tuple(numbers)) for mask, numbers in groups.items())
+    return timetable
+
+
+def rank(mask: int) -> tuple:
+    """Scores a week so that fewer days on campus and shorter gaps between classes come first.
+
+    :return: (days with classes, minutes of gaps between classes)
+    :rtype: tuple
+    """
+    days = gaps = 0
+    for day in range(len(DAYS)):
+        minutes = (mask >> (day * MINUTES_PER_DAY)) & DAY_MASK
+        if minutes:
+            days += 1
+            first = (minutes & -minutes).bit_length() - 1
+            gaps += minutes.bit_length() - first - bin(minutes).count("1")
+    return days, gaps
+
+
+def day_bits(mask: int) -> int:
+    """Returns a bitmask of the days that a week has classes on."""
+    return sum(1 << day for day in range(len(DAYS))
+               if (mask >> (day * MINUTES_PER_DAY)) & DAY_MASK)
+
+
+def build_schedules(options: list, limit: int = 10, budget: float = 2.0) -> dict:
+    """Searches for conflict-free combinations with one choice per course.
+    Courses with the fewest choices are placed first, and after every choice the remaining
+    courses are filtered down to what still fits, so dead ends are abandoned immediately.
+    Once enough combinations are found, branches that already need more days on campus than
+    the worst of them are skipped as well, so the combinations in them are never counted.
+
+    :param list options: (course code, [(mask, section numbers)]) for every requested course
+    :param int limit: How many of the best combinations to return
+    :param float budget: How many seconds the search may run for
+    :return: The best combinations as (days, gaps, [(course code, section numbers)]), how many
+        combinations were ranked, whether the search finished within its budget, and whether
+        that count covers every combination because no branch was skipped
+    :rtype: dict
+    """
+    deadline = time.monotonic() + budget
+    best = []  # Heap of the best combinations with the worst one on top
+    found = 0
+    complete = True
+    pruned = False
+
+    def search(chosen: list, mask: int, days: int, remaining: list) -> bool:
+        nonlocal found, complete, pruned
+        if len(best) == limit and bin(days).count("1") > -best[0][0]:
+            pruned = True
+            return True
+        if not remaining:
+            found += 1
+            days, gaps = rank(mask)
+            entry = (-days, -gaps, -found, [(code, numbers) for code, numbers in chosen])
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+            return True
+        if time.monotonic() > deadline:
+            complete = False
+            return False
+        (code, choices), rest = remaining[0], remaining[1:]
+        for choice_mask, numbers, choice_days in choices:
+            new_mask = mask | choice_mask
+            filtered = []
+            for other_code, other_choices in rest:
+                fits = [choice for choice in other_choices if not choice[0] & new_mask]
+                if not fits:
+                    break
+                filtered.append((other_code, fits))
+            else:
+                filtered.sort(key=lambda course: len(course[1]))
+                chosen.append((code, numbers))
+                keep_going = search(chosen, new_mask, days | choice_days, filtered)
+                chosen.pop()
+                if not keep_going:
+                    return False
+        return True
+
+    options = [(code, [(mask, numbers, day_bits(mask)) for mask, numbers in choices])
+               for code, choices in options]
+    search([], 0, 0, sorted(options, key=lambda course: len(course[1])))
+    schedules = sorted(best, reverse=True)
+    return {"schedules": [(-days, -gaps, chosen) for days, gaps, _, chosen in schedules],
+            "found": found,
+            "complete": complete,
+            "exact": complete and not pruned}
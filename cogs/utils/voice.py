@@ -0,0 +1,125 @@
+"""This module keeps voice connections open between sounds so that every honk or song does not
+have to pay for a new voice handshake. A connection that stops playing is kept for an idle
+grace period and then disconnected from the event loop, never from the audio thread.
+"""
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+
+import discord
+
+
+class Playback:
+    """Audio that was started, with a future that completes once it stops playing."""
+    __slots__ = ("guild_id", "source", "done")
+
+    def __init__(self, guild_id: int, source: discord.AudioSource, done: asyncio.Future):
+        self.guild_id = guild_id
+        self.source = source
+        self.done = done  # Result is the error that stopped the audio, or None
+
+
+class VoiceSessions:
+    """The voice connection of every server, shared by every cog that plays audio."""
+    def __init__(self, bot, idle_timeout: float = 60.0):
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self.idle_handles = {}  # Guild ID -> scheduled disconnect
+        self.connect_latencies = deque(maxlen=100)  # Seconds taken by recent handshakes
+        self.connects = 0
+        self.reuses = 0
+        self.log = logging.getLogger(__name__)
+
+    async def connect(self, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        """Returns a connection to a voice channel, reusing the server's open one if possible.
+
+        :param discord.VoiceChannel channel: The channel to play audio in
+        :return: The connection
+        :rtype: discord.VoiceClient
+        """
+        self.cancel_idle(channel.guild.id)
+        voice_client = channel.guild.voice_client
+        if voice_client is not None and voice_client.is_connected():
+            self.reuses += 1
+            if voice_client.channel != channel:
+                await voice_client.move_to(channel)
+            return voice_client
+
+        start = time.perf_counter()
+        voice_client = await channel.connect()
+        self.connect_latencies.append(time.perf_counter() - start)
+        self.connects += 1
+        return voice_client
+
+    def play(self, voice_client: discord.VoiceClient, source: discord.AudioSource, *,
+             keep_connection: bool = False) -> Playback:
+        """Plays audio and starts the idle grace period once it finishes.
+
+        :param discord.VoiceClient voice_client: The connection to play in
+        :param discord.AudioSource source: The audio to play
+        :param bool keep_connection: Skips the idle grace period for callers that play more
+            audio afterwards, which must call release() once they are done
+        :return: The audio that is playing, which can be awaited through its done future
+        :rtype: Playback
+        """
+        playback = Playback(voice_client.guild.id, source, self.bot.loop.create_future())
+
+        def finished(error):
+            # This runs in the audio thread, so anything else has to happen on the event loop
+            self.bot.loop.call_soon_threadsafe(self.finish, playback, error, keep_connection)
+
+        voice_client.play(source, after=finished)
+        # Only audio that started keeps the connection open, since a failed play() never calls
+        # finished(). finished() is run by the event loop, so it cannot be missed here.
+        self.cancel_idle(playback.guild_id)
+        return playback
+
+    def finish(self, playback: Playback, error: Exception, keep_connection: bool) -> None:
+        """Completes audio that stopped playing."""
+        if error:
+            self.log.error("voice_client: %s", error)
+        if not playback.done.done():
+            playback.done.set_result(error)
+        if not keep_connection:
+            self.release(playback.guild_id)
+
+    def release(self, guild_id: int) -> None:
+        """Disconnects from a server after the idle grace period unless audio plays again."""
+        self.cancel_idle(guild_id)
+        self.idle_handles[guild_id] = self.bot.loop.call_later(
+            self.idle_timeout, lambda: self.bot.loop.create_task(self.disconnect(guild_id)))
+
+    def cancel_idle(self, guild_id: int) -> None:
+        """Keeps a server's connection open."""
+        handle = self.idle_handles.pop(guild_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    async def disconnect(self, guild_id: int, *, force: bool = False) -> None:
+        """Disconnects from a server unless audio is playing there, or even then if forced."""
+        self.cancel_idle(guild_id)
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild is not None else None
+        if voice_client is None or (voice_client.is_playing() and not force):
+            return
+        try:
+            await voice_client.disconnect()
+        except (asyncio.TimeoutError, discord.ClientException) as exc:
+            self.log.error("%s: %s", type(exc).__name__, exc)
+
+    def stats(self) -> dict:
+        """Summarizes how connections were made.
+
+        :return: Open connections, handshakes, reused connections and handshake latencies in ms
+        :rtype: dict
+        """
+        latencies = sorted(self.connect_latencies)
+        return {"connected": len(self.bot.voice_clients),
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "connect_p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+                "connect_p95_ms": (latencies[int(0.95 * (len(latencies) - 1))] * 1000
+                                   if latencies else None),
+                "connect_max_ms": latencies[-1] * 1000 if latencies else None}
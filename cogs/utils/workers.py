@@ -0,0 +1,37 @@
+"""This module runs CPU bound work in worker processes so that it never blocks the event loop.
+A worker that dies, for example because it ran out of memory, breaks its whole pool, so the
+pool is replaced and only the work that was running at the time fails.
+"""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPool:
+    """A process pool that starts over with new workers once it is broken."""
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.log = logging.getLogger(__name__)
+
+    async def run(self, function, *args):
+        """Runs a function in a worker process and waits for its result.
+
+        :raises BrokenProcessPool: If a worker died while the function was waiting or running,
+            which only affects this call since the pool is replaced
+        """
+        executor = self.executor
+        try:
+            return await asyncio.get_event_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # Every call that was waiting fails at once, but only the first replaces the pool
+            if self.executor is executor:
+                self.log.error("A worker process died; starting new workers")
+                executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            raise
+
+    def shutdown(self) -> None:
+        """Stops the workers without waiting for work that is running."""
+        self.executor.shutdown(wait=False)
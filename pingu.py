@@ -16,6 +16,7 @@ import discord
 from discord.ext import commands
 
 import settings
+from cogs.utils.voice import VoiceSessions
 
 
 class Pingu(commands.Bot):
@@ -35,6 +36,7 @@ class Pingu(commands.Bot):
                       "success": ":white_check_mark:"}
         self.log = logging.getLogger("pingu")
         self.log.info("Starting instance")
+        self.voice_sessions = VoiceSessions(self, settings.VOICE_IDLE_TIMEOUT)
 
         super().__init__(command_prefix=self.current["prefix"],
                          description=self.current["desc"],
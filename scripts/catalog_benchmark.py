@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Benchmarks parsing, indexing, lookups and rendering of the schedule catalog.
+Run it from the PinguBot directory against a cache file created by the Schedules cog:
+
+    python scripts/catalog_benchmark.py cache/latest-scheduledata.json
+
+Use --sections instead of a cache file to measure synthetic catalogs of one or more sizes:
+
+    python scripts/catalog_benchmark.py --sections 1000 10000 100000 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from cogs.schedules import section_table
+from cogs.utils import catalog, paginator, search, snapshot
+from synthetic_catalog import generate_catalog
+
+
+def memory_report(data: dict) -> dict:
+    """Measures the resident size of a semester as raw JSON and as a course index.
+
+    :param dict data: The parsed JSON of a semester's catalog
+    :return: The sizes in bytes and how many times smaller the index is
+    :rtype: dict
+    """
+    raw_bytes = catalog.memory_footprint(data)
+    index_bytes = catalog.memory_footprint(catalog.build_course_index(data))
+    return {"raw_bytes": raw_bytes,
+            "index_bytes": index_bytes,
+            "ratio": round(raw_bytes / index_bytes, 2) if index_bytes else None}
+
+
+def _elapsed_ms(start: float) -> float:
+    """Returns the milliseconds that passed since a time.perf_counter() reading."""
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def percentiles(samples: list) -> dict:
+    """Summarizes latencies in seconds as percentiles in microseconds."""
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_us": round(cuts[49] * 1e6, 2),
+            "p95_us": round(cuts[94] * 1e6, 2),
+            "p99_us": round(cuts[98] * 1e6, 2),
+            "max_us": round(max(samples) * 1e6, 2)}
+
+
+def _time_each(function, arguments: list) -> dict:
+    """Times a function once per argument and summarizes the latencies."""
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def scaling_report(payload: str, lookups: int = 1000) -> dict:
+    """Measures every stage a semester goes through, from its JSON to the messages sent.
+
+    :param str payload: The JSON of a semester's catalog
+    :param int lookups: How many random courses to look up, search for and render
+    :return: Timings in milliseconds, peak memory in bytes and lookup latency percentiles
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    data = json.loads(payload)
+    parse_ms = _elapsed_ms(start)
+    start = time.perf_counter()
+    course_index = catalog.build_course_index(data)
+    index_ms = _elapsed_ms(start)
+    del data
+
+    # Tracing slows allocations down, so peak memory is measured by loading the semester again
+    tracemalloc.start()
+    catalog.load_semester(payload)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.snapshot")
+        start = time.perf_counter()
+        snapshot.write_snapshot(filename, "0" * 64, "202090", {}, course_index)
+        snapshot_write_ms = _elapsed_ms(start)
+        start = time.perf_counter()
+        loaded = snapshot.load_snapshot(filename)
+        snapshot_load_ms = _elapsed_ms(start)
+
+        rng = random.Random(lookups)
+        codes = rng.choices(list(course_index), k=lookups)
+        index = catalog.ScheduleIndex().with_semester("202090", loaded.courses,
+                                                      current_semester="202090",
+                                                      semester_codes={"202090": "Fall 2020"})
+        start = time.perf_counter()
+        search_index = search.SearchIndex(course_index)
+        search_index_ms = _elapsed_ms(start)
+        titles = [search_index.titles[code] for code in codes]
+        report = {
+            "sections": sum(len(sections) for sections in course_index.values()),
+            "courses": len(course_index),
+            "payload_bytes": len(payload),
+            "parse_ms": parse_ms,
+            "index_ms": index_ms,
+            "peak_memory_bytes": peak_bytes,
+            "index_bytes": catalog.memory_footprint(course_index),
+            "snapshot_write_ms": snapshot_write_ms,
+            "snapshot_load_ms": snapshot_load_ms,
+            "search_index_ms": search_index_ms,
+            "lookup": _time_each(lambda code: index.get_sections("202090", code), codes),
+            "search_code": _time_each(search_index.search, [code[:-1] for code in codes]),
+            "search_title": _time_each(search_index.search, titles),
+            "render": _time_each(
+                lambda code: paginator.paginate_table(section_table(course_index[code])), codes),
+        }
+        loaded.courses.buffer.close()
+    return report
+
+
+async def _measure_stall(load) -> float:
+    """Runs a loader while a heartbeat checks how late the event loop wakes it up."""
+    longest_stall = 0.0
+    finished = asyncio.Event()
+
+    async def heartbeat():
+        nonlocal longest_stall
+        while not finished.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            longest_stall = max(longest_stall, time.perf_counter() - start - 0.005)
+
+    beat = asyncio.ensure_future(heartbeat())
+    await asyncio.sleep(0.02)
+    await load()
+    finished.set()
+    await beat
+    return longest_stall
+
+
+def stall_report(payload: str) -> dict:
+    """Measures the longest event loop stall while loading a payload on and off the loop.
+
+    :param str payload: The JSON of a semester's catalog
+    :return: The longest stall in milliseconds for each strategy
+    :rtype: dict
+    """
+    async def on_loop():
+        catalog.load_semester(payload)
+
+    async def in_worker():
+        await asyncio.get_event_loop().run_in_executor(executor, catalog.load_semester, payload)
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        # Start the worker up front, just like the cog does before its first refresh
+        executor.submit(int).result()
+        loop = asyncio.new_event_loop()
+        try:
+            return {"on_loop_ms": round(loop.run_until_complete(_measure_stall(on_loop)) * 1000, 2),
+                    "worker_ms": round(loop.run_until_complete(_measure_stall(in_worker)) * 1000, 2)}
+        finally:
+            loop.close()
+
+
+def main():
+    """Prints the reports as JSON so that runs can be compared between commits."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("cache_file", nargs="?",
+                        help="A *-scheduledata.json file from the cache directory")
+    source.add_argument("--sections", type=int, nargs="+",
+                        help="Sizes of synthetic catalogs to use instead")
+    parser.add_argument("--lookups", type=int, default=1000,
+                        help="How many random courses to look up, search for and render")
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.sections:
+        catalogs = [(f"synthetic-{size}", generate_catalog(size)) for size in args.sections]
+    else:
+        with open(args.cache_file, "r") as cache_file:
+            catalogs = [(os.path.basename(args.cache_file), json.load(cache_file))]
+    results = {"python": platform.python_version(),
+               "platform": platform.platform(),
+               "runs": []}
+    for name, data in catalogs:
+        payload = json.dumps(data)
+        results["runs"].append({"catalog": name,
+                                "memory": memory_report(data),
+                                "scaling": scaling_report(payload, args.lookups),
+                                "event_loop_stall": stall_report(payload)})
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Compares playing a sound effect from the Opus cache against decoding it with ffmpeg.
+Run it from the PinguBot directory:
+
+    python scripts/soundfx_benchmark.py soundfx/honk.mp3 --plays 20
+
+Each play reads every frame the way a voice client does. The ffmpeg path also encodes the
+frames to Opus when libopus can be loaded, because a voice client has to do that as well.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cogs.utils import soundfx  # pylint: disable=wrong-import-position
+
+
+def cpu_seconds() -> float:
+    """Returns the CPU time used by this process and the subprocesses it waited for."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def play(create_source, encoder=None) -> tuple:
+    """Reads a source until it ends.
+
+    :return: (seconds until the first packet, CPU seconds used, packets read)
+    :rtype: tuple
+    """
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    source = create_source()
+    first_packet = None
+    packets = 0
+    try:
+        while True:
+            frame = source.read()
+            if not frame:
+                break
+            if encoder is not None and not source.is_opus():
+                frame = encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+            if first_packet is None:
+                first_packet = time.perf_counter() - start
+            packets += 1
+    finally:
+        source.cleanup()
+    return first_packet, cpu_seconds() - cpu_start, packets
+
+
+def summarize(results: list) -> dict:
+    """Summarizes the plays of one strategy in milliseconds."""
+    first_packets = [first_packet for first_packet, _, _ in results]
+    cpu_times = [cpu_time for _, cpu_time, _ in results]
+    return {"plays": len(results),
+            "packets": results[0][2],
+            "first_packet_p50_ms": round(statistics.median(first_packets) * 1000, 3),
+            "first_packet_max_ms": round(max(first_packets) * 1000, 3),
+            "cpu_per_play_ms": round(statistics.mean(cpu_times) * 1000, 3)}
+
+
+def main():
+    """Prints the results as JSON so that runs can be compared between commits."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sound_file", help="The sound effect to play")
+    parser.add_argument("--plays", type=int, default=20, help="How many times to play it")
+    parser.add_argument("--executable", default="ffmpeg", help="The ffmpeg executable to use")
+    args = parser.parse_args()
+
+    encoder = None
+    try:
+        if not discord.opus.is_loaded():
+            discord.opus._load_default()  # pylint: disable=protected-access
+        encoder = discord.opus.Encoder()
+    except (discord.opus.OpusNotLoaded, OSError):
+        pass
+
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    packets = asyncio.run(soundfx.encode_opus(args.sound_file, args.executable))
+    encode_ms = round((time.perf_counter() - start) * 1000, 3)
+    encode_cpu_ms = round((cpu_seconds() - cpu_start) * 1000, 3)
+
+    def ffmpeg_source():
+        return discord.PCMVolumeTransformer(
+            discord.FFmpegPCMAudio(args.sound_file, executable=args.executable))
+
+    ffmpeg_results = [play(ffmpeg_source, encoder) for _ in range(args.plays)]
+    cached_results = [play(lambda: soundfx.CachedOpusAudio(packets)) for _ in range(args.plays)]
+    print(json.dumps({"sound_file": args.sound_file,
+                      "ffmpeg_includes_opus_encoding": encoder is not None,
+                      "cache": {"encode_ms": encode_ms,
+                                "encode_cpu_ms": encode_cpu_ms,
+                                "bytes": sum(len(packet) for packet in packets)},
+                      "ffmpeg": summarize(ffmpeg_results),
+                      "cached": summarize(cached_results)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Generates a catalog shaped like the NJIT alltitlecourselist JSON for testing and benchmarks.
+Run it from the PinguBot directory to write a file the Schedules cog can load as a cache file:
+
+    python scripts/synthetic_catalog.py 10000 cache/latest-scheduledata.json
+
+The same size and seed always produce the same catalog.
+"""
+import argparse
+import itertools
+import json
+import random
+import string
+
+
+SUBJECTS = ("CS", "IS", "IT", "MATH", "PHYS", "CHEM", "ECE", "ME", "CE", "BIOL", "HIST", "HUM",
+            "ENGL", "MGMT", "FIN", "ACCT", "ARCH", "STS", "PHIL", "THTR")
+TITLE_WORDS = ("Introduction", "Advanced", "Principles", "Topics", "Data", "Structures",
+               "Algorithms", "Systems", "Design", "Analysis", "Theory", "Applied", "Computer",
+               "Networks", "Calculus", "Linear", "Algebra", "Physics", "Chemistry", "Biology",
+               "History", "Writing", "Management", "Finance", "Security", "Machine", "Learning",
+               "Database", "Software", "Engineering", "Mechanics", "Circuits", "Ethics",
+               "Laboratory")
+LAST_NAMES = ("Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson",
+              "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson", "White",
+              "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker", "Young")
+FIRST_NAMES = ("James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica")
+METHODS = ("Face-to-Face", "Face-to-Face", "Face-to-Face", "Online", "Hybrid",
+           "Converged Learning")
+DAY_PATTERNS = ("MW", "TR", "MWF", "M", "T", "W", "R", "F", "S", "MR", "TF")
+START_TIMES = (830, 1000, 1130, 1300, 1430, 1600, 1800, 1930)
+MAX_COURSE_NUMBER = 999
+SEMESTER_CODES = (("202090", "Fall 2020"), ("202050", "Summer 2020"), ("202010", "Spring 2020"),
+                  ("201990", "Fall 2019"), ("201950", "Summer 2019"), ("201910", "Spring 2019"))
+
+
+def _meeting(rng: random.Random) -> dict:
+    """Creates a raw meeting with a realistic day pattern and length."""
+    start = rng.choice(START_TIMES)
+    length = rng.choice((50, 80, 80, 160))
+    end = (start // 100 * 60 + start % 100) + length
+    return {"MTG_DAYS": rng.choice(DAY_PATTERNS),
+            "START_TIME": f"{start:04d}",
+            "END_TIME": f"{end // 60:02d}{end % 60:02d}"}
+
+
+def _section(rng: random.Random, number: int, title: str) -> dict:
+    """Creates a raw section, which can have no meetings, one meeting or several of them."""
+    capacity = rng.choice((20, 30, 40, 60, 150))
+    section = {"SECTION": f"{number:03d}" if number < 100 else f"H{number % 100:02d}",
+               "INSTRUCTOR": (f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}"
+                              if rng.random() > 0.08 else ", "),
+               "ENROLLED": str(rng.randint(0, capacity)),
+               "CAPACITY": str(capacity),
+               "INSTRUCTIONMETHOD": rng.choice(METHODS),
+               "TITLE": title,
+               "CRN": str(rng.randint(10000, 99999)),
+               "COMMENTS": ""}
+    meetings = rng.choices((0, 1, 2, 3), weights=(1, 6, 3, 1))[0]
+    if meetings == 1:
+        section["Schedule"] = _meeting(rng)
+    elif meetings > 1:
+        section["Schedule"] = [_meeting(rng) for _ in range(meetings)]
+    return section
+
+
+def _extra_subjects():
+    """Yields made-up subject codes for when every real one has run out of course numbers."""
+    for letters in itertools.product(string.ascii_uppercase, repeat=3):
+        subject = "".join(letters)
+        if subject not in SUBJECTS:
+            yield subject
+
+
+def generate_catalog(sections: int, seed: int = 0, current_semester: str = "202090") -> dict:
+    """Creates a catalog with exactly the given number of sections.
+    Like the real catalog, a section or meeting that appears once is a dictionary instead of a
+    list, some sections have no meeting times and some have no instructor. Course numbers
+    never go past 999, so large catalogs have more subjects instead.
+
+    :param int sections: How many sections to create
+    :param int seed: Seeds the random choices
+    :param str current_semester: The semester code stored as the current one
+    :return: The catalog as parsed JSON
+    :rtype: dict
+    """
+    rng = random.Random(f"{sections}-{seed}")
+    subjects = {}
+    numbers = {}
+    open_subjects = list(SUBJECTS)
+    extra_subjects = _extra_subjects()
+    while sections > 0:
+        subject = rng.choice(open_subjects)
+        number = numbers.get(subject, 99) + rng.randint(1, 3)
+        if number > MAX_COURSE_NUMBER:
+            open_subjects[open_subjects.index(subject)] = next(extra_subjects)
+            continue
+        numbers[subject] = number
+        title = " ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4)))
+        count = min(sections, rng.choices((1, 2, 3, 4, 6, 10, 25),
+                                          weights=(8, 6, 4, 3, 2, 1, 1))[0])
+        sections -= count
+        raw_sections = [_section(rng, number, title) for number in range(1, count + 1)]
+        subjects.setdefault(subject, []).append(
+            {"COURSE": f"{subject}{numbers[subject]}",
+             "Section": raw_sections if count > 1 else raw_sections[0]})
+    return {"ct": int(current_semester),
+            "ts": {"WSRESPONSE": {"SOAXREF": [{"EDIVALUE": code, "DESCRIPTION": description}
+                                              for code, description in SEMESTER_CODES]}},
+            "ws": {"WSRESPONSE": {"Subject": [{"SUBJ": subject, "Course": courses}
+                                              for subject, courses in sorted(subjects.items())]}}}
+
+
+def main():
+    """Writes a synthetic catalog in the format of the Schedules cog's cache files."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sections", type=int, help="How many sections to create")
+    parser.add_argument("output", help="Where to write the catalog JSON")
+    parser.add_argument("--seed", type=int, default=0, help="Seeds the random choices")
+    args = parser.parse_args()
+
+    with open(args.output, "w") as output_file:
+        json.dump(generate_catalog(args.sections, args.seed), output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,24 @@ default = {"activity": discord.Activity(type=discord.ActivityType.watching,
 TOKEN = os.environ.get("PINGU_TOKEN")
 COGS = ["admin", "alert", "clown", "help"]
 VERSION = "0.0.3"
+
+# Voice: seconds an idle voice connection is kept open so the next sound can reuse it
+VOICE_IDLE_TIMEOUT = 60.0
+# Music: how many youtube_dl lookups can run at once and how many results are kept
+MUSIC_EXTRACT_WORKERS = 2
+MUSIC_EXTRACT_CACHE_SIZE = 256
+# Music: volume tracks are played at. Opus streams are only passed through untouched at 1.0
+MUSIC_VOLUME = 1.0
+# Music: where downloaded tracks are kept and how many bytes of them to keep
+MUSIC_CACHE_DIRECTORY = "cache/audio"
+MUSIC_CACHE_BYTES = 2 * 1024 ** 3
+# Schedules: how many of the most recent semesters to keep loaded, and how many to download at once
+SCHEDULE_SEMESTERS = 2
+SCHEDULE_FETCH_LIMIT = 2
+SCHEDULE_STORAGE = "memory"  # or "postgres" to share one copy of the catalog between processes
+# Schedules: the most courses ~schedule build accepts and how many seconds it may search for
+SCHEDULE_BUILD_COURSES = 7
+SCHEDULE_BUILD_BUDGET = 2.0
+# Schedules: how many builds run at once, and how many more seconds one may wait for a worker
+SCHEDULE_BUILD_WORKERS = 1
+SCHEDULE_BUILD_WAIT = 3.0
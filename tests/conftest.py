@@ -0,0 +1,37 @@
+"""Fixtures shared by the tests.
+Database tests connect with the usual PG* environment variables and are skipped when no server
+is available. Every test works in a schema of its own that is dropped afterwards.
+"""
+import asyncio
+import uuid
+
+import asyncpg
+import pytest
+
+
+@pytest.fixture
+def postgres():
+    """Runs a test coroutine with a pool whose connections only see the test's schema."""
+    def run(test) -> None:
+        async def main():
+            try:
+                admin = await asyncpg.connect(timeout=5)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError,
+                    asyncpg.InterfaceError) as exc:
+                pytest.skip(f"PostgreSQL is not available: {exc}")
+            schema = f"test_{uuid.uuid4().hex}"
+            await admin.execute(f"CREATE SCHEMA {schema};")
+            try:
+                pool = await asyncpg.create_pool(min_size=1, max_size=2,
+                                                 server_settings={"search_path": schema})
+                try:
+                    await test(pool)
+                finally:
+                    await pool.close()
+            finally:
+                await admin.execute(f"DROP SCHEMA {schema} CASCADE;")
+                await admin.close()
+
+        asyncio.run(main())
+
+    return run
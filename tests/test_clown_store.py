@@ -0,0 +1,67 @@
+"""Tests for sharing server clowns between processes through PostgreSQL."""
+import asyncio
+
+import asyncpg
+import pytest
+
+from cogs.utils.clown_store import ClownCache, ClownStore
+
+
+# The same table the Dockerfile creates
+CLOWNS = ("CREATE TABLE clowns (guild_id numeric(25,0) PRIMARY KEY, clown_id numeric(25,0), "
+          "clowned_on date);")
+
+
+async def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Waits for a notification to be applied, since it arrives on its own connection."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+def test_changes_reach_listening_processes(postgres):
+    async def test(pool):
+        async with pool.acquire() as conn:
+            await conn.execute(CLOWNS)
+        listening = ClownCache(ClownStore(pool))
+        changing = ClownCache(ClownStore(pool))
+        await listening.listen()
+        try:
+            await listening.load()
+            assert listening.listening and listening.loaded
+            assert not listening.is_clown(1, 10)
+
+            await changing.set(1, 10)
+            assert await wait_for(lambda: listening.is_clown(1, 10))
+            await changing.set(1, 20)
+            assert await wait_for(lambda: listening.is_clown(1, 20))
+        finally:
+            await listening.close()
+        assert not listening.listening
+
+    postgres(test)
+
+
+def test_failed_load_is_retried_while_listening(postgres):
+    async def test(pool):
+        cache = ClownCache(ClownStore(pool))
+        await cache.listen()
+        try:
+            with pytest.raises(asyncpg.UndefinedTableError):
+                await cache.load()
+            # The table does not exist yet, so only the listener works
+            assert cache.listening and not cache.loaded
+
+            async with pool.acquire() as conn:
+                await conn.execute(CLOWNS)
+                await conn.execute("INSERT INTO clowns VALUES (1, 10, NOW());")
+            await cache.load()
+            assert cache.loaded
+            assert cache.is_clown(1, 10)
+        finally:
+            await cache.close()
+
+    postgres(test)
@@ -0,0 +1,126 @@
+"""Tests for revalidating cache files against a stub of the NJIT endpoint."""
+import asyncio
+import os
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cogs.utils.fetcher import CacheFileFetcher
+
+
+class StubCatalog:
+    """Serves a catalog like the NJIT endpoint and answers conditional requests with a 304."""
+    def __init__(self, payload: str, etag: str = '"1"', last_modified: str = None):
+        self.payload = payload
+        self.etag = etag
+        self.last_modified = last_modified
+        self.status = 200
+        self.requests = []  # Headers of every request
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.headers))
+        if self.status != 200:
+            return web.Response(status=self.status)
+        headers = {}
+        if self.etag is not None:
+            headers["ETag"] = self.etag
+            if request.headers.get("If-None-Match") == self.etag:
+                return web.Response(status=304, headers=headers)
+        if self.last_modified is not None:
+            headers["Last-Modified"] = self.last_modified
+            if request.headers.get("If-Modified-Since") == self.last_modified:
+                return web.Response(status=304, headers=headers)
+        return web.Response(text=f"define({self.payload})", headers=headers)
+
+
+def run_against(stub: StubCatalog, scenario):
+    """Runs a scenario with a fetcher whose endpoint is the stub."""
+    async def main():
+        app = web.Application()
+        app.router.add_get("/courseschedule", stub.handle)
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as session:
+                await scenario(CacheFileFetcher(session), str(server.make_url("/courseschedule")))
+    asyncio.run(main())
+
+
+def test_etag_revalidation_costs_a_304(tmp_path):
+    filename = str(tmp_path / "latest-scheduledata.json")
+    stub = StubCatalog('{"ct": "202090"}')
+
+    async def scenario(fetcher, endpoint):
+        assert await fetcher.fetch(filename, endpoint) == '{"ct": "202090"}'
+        assert fetcher.has_validators(endpoint)
+        assert await fetcher.fetch(filename, endpoint) is None
+        stub.payload, stub.etag = '{"ct": "202110"}', '"2"'
+        assert await fetcher.fetch(filename, endpoint) == '{"ct": "202110"}'
+
+    run_against(stub, scenario)
+    assert "If-None-Match" not in stub.requests[0]
+    assert stub.requests[1]["If-None-Match"] == '"1"'
+    assert stub.requests[2]["If-None-Match"] == '"1"'
+    with open(filename) as cache_file:
+        assert cache_file.read() == '{"ct": "202110"}'
+
+
+def test_last_modified_revalidation(tmp_path):
+    filename = str(tmp_path / "latest-scheduledata.json")
+    stub = StubCatalog("{}", etag=None, last_modified="Wed, 21 Oct 2020 07:28:00 GMT")
+
+    async def scenario(fetcher, endpoint):
+        assert await fetcher.fetch(filename, endpoint) == "{}"
+        assert await fetcher.fetch(filename, endpoint) is None
+
+    run_against(stub, scenario)
+    assert stub.requests[1]["If-Modified-Since"] == "Wed, 21 Oct 2020 07:28:00 GMT"
+
+
+def test_cache_file_age_is_sent_without_validators(tmp_path):
+    filename = str(tmp_path / "latest-scheduledata.json")
+    with open(filename, "w") as cache_file:
+        cache_file.write("{}")
+    os.utime(filename, (1603265280, 1603265280))
+    stub = StubCatalog("{}", etag=None)
+
+    async def scenario(fetcher, endpoint):
+        await fetcher.fetch(filename, endpoint)
+        assert not fetcher.has_validators(endpoint)
+
+    run_against(stub, scenario)
+    assert stub.requests[0]["If-Modified-Since"] == "Wed, 21 Oct 2020 07:28:00 GMT"
+
+
+def test_errors_keep_the_cache_file(tmp_path):
+    filename = str(tmp_path / "latest-scheduledata.json")
+    with open(filename, "w") as cache_file:
+        cache_file.write('{"ct": "202090"}')
+    stub = StubCatalog("{}")
+    stub.status = 503
+
+    async def scenario(fetcher, endpoint):
+        assert await fetcher.fetch(filename, endpoint) is None
+        assert not fetcher.has_validators(endpoint)
+
+    run_against(stub, scenario)
+    with open(filename) as cache_file:
+        assert cache_file.read() == '{"ct": "202090"}'
+
+
+def test_unconditional_fetch_ignores_validators(tmp_path):
+    filename = str(tmp_path / "latest-scheduledata.json")
+    stub = StubCatalog('{"ct": "202090"}', last_modified="Wed, 21 Oct 2020 07:28:00 GMT")
+
+    async def scenario(fetcher, endpoint):
+        assert await fetcher.fetch(filename, endpoint) == '{"ct": "202090"}'
+        # The file on disk could not be loaded, so a 304 would leave the semester unloaded
+        with open(filename, "w") as cache_file:
+            cache_file.write('{"ct": ')
+        assert await fetcher.fetch(filename, endpoint, conditional=False) == '{"ct": "202090"}'
+
+    run_against(stub, scenario)
+    assert "If-None-Match" not in stub.requests[1]
+    assert "If-Modified-Since" not in stub.requests[1]
+    with open(filename) as cache_file:
+        assert cache_file.read() == '{"ct": "202090"}'
+    assert os.listdir(tmp_path) == ["latest-scheduledata.json"]
@@ -0,0 +1,146 @@
+"""Tests for storing schedule data in PostgreSQL."""
+from cogs.utils import catalog, schedule_store
+
+
+# The same table the Dockerfile creates
+SECTION_WATCHES = ("CREATE TABLE section_watches (user_id numeric(25,0), semester text, "
+                   "course text, section text, PRIMARY KEY (semester, course, section, user_id));")
+
+
+def section(number: str, instructor: str, title: str, enrolled: int = 10,
+            capacity: int = 20, meetings: tuple = ()) -> catalog.Section:
+    meeting_times = "\n".join(f"{meeting.days}: {meeting.start} - {meeting.end}"
+                              for meeting in meetings) or catalog.NO_MEETING_TIMES
+    return catalog.Section(number, instructor, enrolled, capacity, "Face-to-Face", title,
+                           meetings, meeting_times)
+
+
+COURSES = {
+    "CS100": (section("001", "Smith, John", "Roadmap to Computing",
+                      meetings=(catalog.Meeting("MW", 600, 680),)),
+              section("002", "Doe, Jane", "Roadmap to Computing", enrolled=20,
+                      meetings=(catalog.Meeting("T", 840, 960), catalog.Meeting("R", 840, 900)))),
+    "CS280": (section("001", "Smith, John", 'Programming "Language" Concepts, \\ and more'),),
+    "MATH111": (section("101", "", "Calculus I", meetings=(catalog.Meeting("F", 0, 50),)),),
+}
+
+
+async def ingest(store, tmp_path, semester_code: str, version: str, courses: dict) -> None:
+    filename = str(tmp_path / f"{semester_code}.csv")
+    assert schedule_store.write_sections(filename, semester_code, courses) == sum(
+        len(sections) for sections in courses.values())
+    await store.ingest(semester_code, version, filename, current_semester=semester_code,
+                       semester_codes={semester_code: f"Semester {semester_code}"})
+
+
+def test_ingest_round_trips_sections(postgres, tmp_path):
+    async def test(pool):
+        store = schedule_store.PostgresScheduleStore(pool)
+        await store.create_tables()
+        await ingest(store, tmp_path, "202090", "first", COURSES)
+
+        index = await store.load_index()
+        assert index.current_semester == "202090"
+        assert index.versions == {"202090": "first"}
+        for code, sections in COURSES.items():
+            assert await store.get_sections("202090", code) == sections
+        assert await store.get_sections("202090", "CS999") == ()
+
+        # Ingesting again replaces every section of the semester
+        await ingest(store, tmp_path, "202090", "second", {"CS100": COURSES["CS100"][:1]})
+        assert (await store.load_index()).versions == {"202090": "second"}
+        assert await store.get_sections("202090", "CS100") == COURSES["CS100"][:1]
+        assert await store.get_sections("202090", "CS280") == ()
+
+    postgres(test)
+
+
+def test_queries(postgres, tmp_path):
+    async def test(pool):
+        store = schedule_store.PostgresScheduleStore(pool)
+        await store.create_tables()
+        await ingest(store, tmp_path, "202090", "first", COURSES)
+
+        assert await store.search_courses("202090", "cs") == [
+            ("CS100", "Roadmap to Computing"),
+            ("CS280", 'Programming "Language" Concepts, \\ and more')]
+        assert await store.search_courses("202090", "calculus") == [("MATH111", "Calculus I")]
+        assert [(code, found.section) for code, found
+                in await store.instructor_sections("202090", "john smith")] == [
+                    ("CS100", "001"), ("CS280", "001")]
+        assert await store.instructor_sections("202090", "!") == []
+        assert await store.seat_counts([("202090", "CS100", "002"),
+                                        ("202090", "CS100", "003")]) == {
+                                            ("202090", "CS100", "002"): (20, 20)}
+
+    postgres(test)
+
+
+def test_retain_semesters(postgres, tmp_path):
+    async def test(pool):
+        store = schedule_store.PostgresScheduleStore(pool)
+        await store.create_tables()
+        await ingest(store, tmp_path, "202010", "old", COURSES)
+        await ingest(store, tmp_path, "202090", "new", COURSES)
+
+        await store.retain_semesters(["202090"])
+        assert (await store.load_index()).versions == {"202090": "new"}
+        assert await store.get_sections("202010", "CS100") == ()
+        assert await store.get_sections("202090", "CS100") == COURSES["CS100"]
+
+    postgres(test)
+
+
+def test_only_one_process_refreshes(postgres):
+    async def test(pool):
+        first = schedule_store.PostgresScheduleStore(pool)
+        second = schedule_store.PostgresScheduleStore(pool)
+        async with first.refresh_lock() as refreshing:
+            assert refreshing
+            # The pool hands the second store another connection, which is another session
+            async with second.refresh_lock() as also_refreshing:
+                assert not also_refreshing
+        async with second.refresh_lock() as refreshing:
+            assert refreshing
+
+    postgres(test)
+
+
+def test_watches_are_shared(postgres):
+    async def test(pool):
+        async with pool.acquire() as conn:
+            await conn.execute(SECTION_WATCHES)
+        leader = schedule_store.SectionWatches(pool)
+        follower = schedule_store.SectionWatches(pool)
+        key = ("202090", "CS100", "001")
+
+        await follower.add(1234, key)
+        await follower.add(1234, key)
+        await follower.add(5678, key)
+        assert await leader.load() == {key: {1234, 5678}}
+
+        await leader.remove(1234, key)
+        assert await follower.load() == {key: {5678}}
+        await leader.remove(5678, key)
+        assert await follower.load() == {}
+
+    postgres(test)
+
+
+def test_only_one_process_notifies(postgres):
+    async def test(pool):
+        first = schedule_store.SectionWatches(pool)
+        second = schedule_store.SectionWatches(pool)
+        try:
+            assert await first.claim_notifier()
+            # The lock stays held between refreshes, so the same process keeps notifying
+            assert await first.claim_notifier()
+            assert not await second.claim_notifier()
+            await first.release_notifier()
+            assert await second.claim_notifier()
+            assert not await first.claim_notifier()
+        finally:
+            await first.release_notifier()
+            await second.release_notifier()
+
+    postgres(test)
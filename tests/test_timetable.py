@@ -0,0 +1,62 @@
+"""Tests for parsing meeting times and searching for conflict-free schedules."""
+import itertools
+
+from cogs.utils import catalog, timetable
+
+
+def meeting(days: str, start: str, end: str) -> dict:
+    return {"MTG_DAYS": days, "START_TIME": start, "END_TIME": end}
+
+
+def test_invalid_meetings_are_skipped():
+    meetings = catalog.normalize_meetings([meeting("MW", "1000", "1120"),
+                                           meeting("T", "1400", "1300"),
+                                           meeting("R", "2500", "2600"),
+                                           meeting("F", "noon", "1300"),
+                                           meeting("S", "", "1300")])
+    assert meetings == (catalog.Meeting("MW", 600, 680),)
+    assert timetable.weekly_mask(meetings)
+
+
+def brute_force(options: list) -> int:
+    """Counts every conflict-free combination without skipping anything."""
+    count = 0
+    for combination in itertools.product(*(choices for _, choices in options)):
+        mask = 0
+        for choice_mask, _ in combination:
+            if mask & choice_mask:
+                break
+            mask |= choice_mask
+        else:
+            count += 1
+    return count
+
+
+def options_for(courses: int, sections: int) -> list:
+    """Courses whose sections each meet for an hour on a different day and time."""
+    options = []
+    for course in range(courses):
+        choices = []
+        for number in range(sections):
+            days = timetable.DAYS[(course + number) % 5]
+            start = 8 * 60 + ((course * sections + number) % 10) * 60
+            meetings = (catalog.Meeting(days, start, start + 50),)
+            choices.append((timetable.weekly_mask(meetings), (f"{number:03d}",)))
+        options.append((f"CS{100 + course}", choices))
+    return options
+
+
+def test_count_is_exact_without_pruning():
+    options = options_for(3, 3)
+    results = timetable.build_schedules(options, limit=1000)
+    assert results["exact"]
+    assert results["found"] == brute_force(options)
+
+
+def test_count_is_a_lower_bound_after_pruning():
+    options = options_for(5, 6)
+    results = timetable.build_schedules(options, limit=3)
+    assert results["complete"]
+    assert not results["exact"]
+    assert len(results["schedules"]) == 3
+    assert results["found"] <= brute_force(options)
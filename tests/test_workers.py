@@ -0,0 +1,21 @@
+"""Tests for replacing worker processes that died."""
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from cogs.utils.workers import WorkerPool
+
+
+def test_dead_worker_is_replaced():
+    async def main():
+        pool = WorkerPool()
+        try:
+            with pytest.raises(BrokenProcessPool):
+                await pool.run(os._exit, 1)  # pylint: disable=protected-access
+            assert await pool.run(pow, 2, 10) == 1024
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())